@@ -59,3 +59,90 @@ speechmode_default = False # if True: commands must be preceeded with .
 talkmode = False # if True: all players can use talk command. False: wizards only.
 
 ansi_color_default = False
+
+# If True, mark the database root as changed on every commit so that the
+#   root record is written out each time, whether it changed or not.
+#   Only the root itself is written. Objects stored elsewhere are still
+#   written only when they are marked as changed. To look for in-place
+#   changes to plain lists or dicts which would be lost, use the !dbcheck
+#   admin command, or: python src/db.py check
+db_dirty_root = False
+
+# The database is checked every pack_check_interval seconds, and packed
+#   (in a separate thread) if it has grown by more than pack_growth
+#   bytes since it was last packed, or if it has grown at all and there
+#   have been no commits for pack_idle seconds.
+pack_check_interval = 60
+pack_growth = 10 * 1024 * 1024
+pack_idle = 300
+
+# If True, changes committed during group_commit_window seconds are
+#   collected (using savepoints) and written to the database together
+#   in a single transaction. A command which fails still only loses
+#   its own changes.
+group_commit = False
+group_commit_window = 0.005
+
+# Mobs act on a tick every tick_interval seconds. The ticker spends at
+#   most tick_budget seconds per tick on mobs (always at least one mob)
+#   and leaves the rest for the next tick. tick_slots is the number of
+#   buckets in the time wheel.
+tick_interval = 0.25
+tick_budget = 0.05
+tick_slots = 1024
+
+# Persistent timers (room periodic calls, traps) are checked and fired
+#   every timer_interval seconds.
+timer_interval = 0.2
+
+# Results of parsing input lines up to parse_cache_line_length characters
+#   long are cached. The cache holds at most parse_cache_size lines.
+parse_cache_size = 512
+parse_cache_line_length = 24
+
+# If True, the command parser uses packrat memoization (see: python
+#   src/parse.py corpus --packrat to compare)
+parse_packrat = False
+
+# Output to each client is collected and sent once per reactor turn, or
+#   right away once more than output_high_water bytes are waiting. If a
+#   client is not reading its output, up to output_max_buffer bytes are
+#   held for it before it is disconnected.
+output_high_water = 64 * 1024
+output_max_buffer = 1024 * 1024
+
+# Number of rendered (colored, wrapped and encoded) messages to cache
+render_cache_size = 2048
+
+# Telnet options offered to clients. NAWS lets the client report its
+#   window width, which is used if the player has not set a width.
+#   MCCP (version 2) compresses all output with zlib, at compression
+#   level telnet_mccp_level (1-9).
+telnet_naws = True
+telnet_mccp = True
+telnet_mccp_level = 6
+
+# WebSocket server, for browser clients. Uses the same commands and
+#   messages as the telnet server, on port websocket_port. Output is
+#   compressed with permessage-deflate if the client supports it, at
+#   compression level websocket_deflate_level (1-9). Messages larger
+#   than websocket_max_message bytes are refused.
+websocket = False
+websocket_port = 4712
+websocket_local_only = True
+websocket_deflate = True
+websocket_deflate_level = 6
+websocket_max_message = 64 * 1024
+
+# Input from each client is queued, and commands are run at up to
+#   input_rate per second, with bursts of up to input_burst commands.
+#   If more than input_queue_max lines are waiting, extra lines are
+#   ignored. Lines longer than input_max_line bytes are ignored.
+input_rate = 4.0
+input_burst = 10
+input_queue_max = 20
+input_max_line = 1024
+
+# Number of PBKDF2 rounds used to hash new passwords. Older hashes
+#   are replaced the next time the player logs in.
+password_iterations = 100000
@@ -855,7 +855,7 @@ def cmd_quit(s, r=None):
 
     '''
 
-    s.transport.loseConnection()
+    s.disconnect()
 
 
 def cmd_who(s, r=None):
@@ -880,6 +880,9 @@ def cmd_cls(s, r=None):
         s.message()
 
  
+width_range = (20, 250)
+
+
 def cmd_set(s, r=None):
     '''set <var> [= <value>]
 
@@ -888,6 +891,11 @@ def cmd_set(s, r=None):
     Variables available for setting:
         ansi        -- send ANSI color codes
         speech      -- turn on/off speech mode
+        width       -- number of characters per line (20 to 250)
+        pager       -- number of lines to show at a time
+                        (see: more)
+
+    Use unset width or unset pager to go back to the default.
 
     '''
 
@@ -905,6 +913,32 @@ def cmd_set(s, r=None):
         elif lowerval == 'false':
             val = False
 
+        if var in ('width', 'pager'):
+            if val is False:
+                # unset (or false) goes back to the default
+                if var in s.player.user_settings:
+                    del s.player.user_settings[var]
+                return
+            try:
+                if val is True:
+                    raise ValueError
+                val = int(val)
+            except ValueError:
+                s.message(var, 'must be a number.')
+                return
+            if var == 'width':
+                low, high = width_range
+                if not low <= val <= high:
+                    s.message('width must be from', low, 'to', high, '.')
+                    return
+            elif val < 0:
+                s.message('pager must not be negative.')
+                return
+            elif not val:
+                if var in s.player.user_settings:
+                    del s.player.user_settings[var]
+                return
+
         if val or lowerval=='false':
             # if lowerval is 'false' user specified 'false'
             # if using unset then val will actually be False
@@ -923,6 +957,19 @@ def cmd_set(s, r=None):
             s.message('You have not set anything yet.')
 
 
+def cmd_more(s, r=None):
+    '''more
+
+    Show the next page of a long listing.
+
+    To show long listings a page at a time, use: set pager=<lines>
+
+    '''
+
+    if not s.more():
+        s.message('Nothing more to show.')
+
+
 def cmd_unset(s, r):
     '''unset <var>
 
@@ -967,13 +1014,26 @@ def cmd_password(s, r):
     oldpwtext = r['old']
     newpwtext = r['new']
 
-    if s.player.check_password(oldpwtext):
-    #if True:
-        s.player.set_password(newpwtext)
-        s.message('Password changed.')
+    d = s.player.check_password_async(oldpwtext)
+    s.wait_for(d, _password_checked, s, newpwtext)
+
+def _password_checked(ok, s, newpwtext):
+    if ok:
+        d = s.player.set_password_async(newpwtext)
+        d.addCallbacks(_password_changed, _password_not_changed,
+                        callbackArgs=(s,), errbackArgs=(s,))
     else:
         s.message('Incorrect password.')
 
+def _password_changed(ignored, s):
+    s.message('Password changed.')
+
+def _password_not_changed(failure, s):
+    print 'cmd_password FAILED'
+    if conf.debug:
+        failure.printTraceback()
+    s.message('Error. Password not changed.')
+
 
 def cmd_xyzzy(s, r=None):
     'xyzzy'
@@ -132,7 +132,8 @@ def cmd_db(s, r=None):
     Show the contents of the database.
 
     If a section is given, show only that section, otherwise
-    show the entire database.
+    show the entire database, followed by the results of the
+    most recent pack.
 
     '''
 
@@ -157,17 +158,66 @@ def cmd_db(s, r=None):
             s.mlmessage(unicode(obj).split('\n'), indent=4)
         s.message('')
 
+    if r is None:
+        pack_report(s)
+
+
+def pack_report(s):
+    'Show the results of the most recent database pack.'
+
+    zodb = TZODB()
+    stats = zodb.pack_stats
+    if zodb.packing:
+        s.message('Pack in progress.')
+    if not stats:
+        s.message('Not packed since server start.')
+    else:
+        import time
+        s.message('Last pack:', time.ctime(stats['time']))
+        s.message('Duration: %.2f seconds' % stats['duration'], indent=4)
+        s.message('Reclaimed: %s bytes' % stats['reclaimed'], indent=4)
+        s.message('Size after pack: %s bytes' % stats['size'], indent=4)
+        s.message('Packs since server start: %s' % stats['count'], indent=4)
+    s.message('Size now: %s bytes' % zodb.storage.getSize())
+
 
 def cmd_pack(s):
     '''pack
 
-    Pack the DB.
+    Pack the DB. The pack runs in the background, and the server
+        keeps running while it does.
 
     '''
 
+    d = TZODB().pack_background()
+    if d is None:
+        s.message('Pack already in progress.')
+        return
+
     s.message('Packing database.')
-    TZODB().pack()
-    s.message('Database Packed.')
+    def done(stats):
+        s.message('Database Packed.')
+        pack_report(s)
+    def failed(failure):
+        s.message('Pack failed.')
+        failure.printTraceback()
+    d.addCallbacks(done, failed)
+
+
+def cmd_dbcheck(s):
+    '''dbcheck
+
+    Look for plain (non-persistent) lists, dicts and sets held by
+        objects in the database. Changes made to these in place
+        will not be saved.
+
+    '''
+
+    import db
+    found = db.find_mutables()
+    for holder, name, typ in found:
+        s.message(u'%s: %s (%s)' % (holder, name, typ), indent=4)
+    s.message(len(found), 'found.')
 
 
 def cmd_backup(s):
@@ -210,8 +260,8 @@ def cmd_restart(s, r=None):
 
 
 def restart(s):
-    for client in s.factory.clients:
-        client.transport.loseConnection()
+    for client in list(s.factory.clients):
+        client.disconnect()
 
     cmd = (conf.python, conf.tzcontrol, '-r')
     os.spawnl(os.P_NOWAIT, conf.python, *cmd)
@@ -248,8 +298,8 @@ def shutdown(s):
 
     '''
 
-    for client in s.factory.clients:
-        client.transport.loseConnection()
+    for client in list(s.factory.clients):
+        client.disconnect()
 
     from twisted.internet import reactor
     reactor.stop()
@@ -349,6 +399,53 @@ def cmd_nudge(s):
     rooms.nudge_all()
 
 
+def cmd_cache(s, r=None):
+    '''cache [clear]
+
+    Show the hit rates of the parse and render caches,
+        or empty the caches.
+
+    '''
+
+    import parse
+    import tzprotocol
+    caches = (('parse', parse.parse_cache),
+                ('render', tzprotocol.render_cache))
+
+    if r == 'clear':
+        for name, cache in caches:
+            cache.clear()
+        s.message('Caches cleared.')
+        return
+
+    for name, cache in caches:
+        stats = cache.stats()
+        lookups = stats['hits'] + stats['misses']
+        if lookups:
+            rate = 100.0 * stats['hits'] / lookups
+        else:
+            rate = 0.0
+        s.message(u'%s: %s/%s entries, %s hits, %s misses (%.1f%%%%)' % (
+                    name, stats['entries'], stats['size'],
+                    stats['hits'], stats['misses'], rate), indent=4)
+
+
+def cmd_timers(s):
+    '''timers
+
+    List the timers waiting to fire.
+
+    '''
+
+    import time
+    import timers
+    pending = timers.pending()
+    now = time.time()
+    for at, obj, method, args in pending:
+        s.message(u'%.1fs: %s.%s' % (at-now, obj, method), indent=4)
+    s.message(len(pending), 'timers.')
+
+
 def cmd_rebuild(s, r=None):
     '''rebuild [<module name>]
 
@@ -397,6 +494,9 @@ def cmd_rebuild(s, r=None):
         import parse
         rebuild(parse)
 
+        import share
+        share.invalidate_cmds()
+
         #import players
         #rebuild(players)
         #import db
@@ -414,6 +514,8 @@ def cmd_rebuild(s, r=None):
                 save = save_all_settings()
                 rebuild(mod)
                 restore_all_settings(save)
+                import share
+                share.invalidate_cmds()
             except Exception, e:
                 s.message('Error rebuilding')
                 s.mlmessage(e)
@@ -0,0 +1,102 @@
+# Copyright 2008 Lee Harr
+#
+# This file is part of TZMud.
+#
+# TZMud is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# TZMud is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with TZMud.  If not, see <http://www.gnu.org/licenses/>.
+
+
+'''Small in-memory caches.
+
+Nothing here is stored in the database.
+
+'''
+
+
+class LRUCache(object):
+    '''Mapping which holds at most size entries, discarding the least
+        recently used entry when it is full.
+
+    Keeps count of hits and misses for reporting.
+
+    '''
+
+    def __init__(self, size):
+        self.size = size
+        self.clear()
+
+    def clear(self):
+        'Remove all entries and reset the counters.'
+
+        self._map = {}
+        # circular doubly linked list of [prev, next, key, value]
+        #   self._root[1] is the most recently used entry
+        self._root = root = []
+        root[:] = [root, root, None, None]
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._map)
+
+    def __contains__(self, key):
+        return key in self._map
+
+    def get(self, key, default=None):
+        'Return the value for key, marking it as recently used.'
+
+        link = self._map.get(key)
+        if link is None:
+            self.misses += 1
+            return default
+
+        self.hits += 1
+        self._unlink(link)
+        self._push(link)
+        return link[3]
+
+    def __setitem__(self, key, value):
+        link = self._map.get(key)
+        if link is not None:
+            link[3] = value
+            self._unlink(link)
+            self._push(link)
+            return
+
+        if len(self._map) >= self.size:
+            oldest = self._root[0]
+            self._unlink(oldest)
+            del self._map[oldest[2]]
+
+        link = [None, None, key, value]
+        self._map[key] = link
+        self._push(link)
+
+    def _unlink(self, link):
+        prev, next = link[0], link[1]
+        prev[1] = next
+        next[0] = prev
+
+    def _push(self, link):
+        root = self._root
+        first = root[1]
+        link[0] = root
+        link[1] = first
+        first[0] = link
+        root[1] = link
+
+    def stats(self):
+        'Return a dict with the size, number of entries, hits and misses.'
+
+        return dict(size=self.size, entries=len(self._map),
+                    hits=self.hits, misses=self.misses)
@@ -23,12 +23,17 @@ probably only be done after deleting any current database first.
 
 '''
 
-DB_VERSION = 4
+DB_VERSION = 6
+
+import time
 
 from ZODB import FileStorage, DB, serialize
 import transaction
 from persistent.dict import PersistentDict
 from persistent.list import PersistentList
+from BTrees.IOBTree import IOBTree
+from BTrees.OOBTree import OOBTree
+from BTrees.IIBTree import IITreeSet
 
 from twisted.internet import reactor
 
@@ -42,6 +47,7 @@ if __name__ == '__main__':
     import conf
     conf.load_plugins = False
 
+import conf
 from conf import datafs, backupdir, datafsname
 
 class TZODB(object):
@@ -74,10 +80,21 @@ class TZODB(object):
         self.conn = self.db.open()
         self.root = self.conn.root()
 
+        self.last_commit = time.time()
+        self.packed_size = self.storage.getSize()
+        self.packing = False
+        self.pack_stats = {}
+
+        self._savepoint = None
+        self._flush_call = None
+        self._held = 0
+        self._unheld = None
+
     def close(self):
         'Close database connection.'
 
         self.commit()
+        self.flush()
         self.conn.close()
         self.db.close()
         self.storage.close()
@@ -94,33 +111,190 @@ class TZODB(object):
     def begin(self):
         'Start a new database transaction.'
 
+        self.flush()
         transaction.begin()
 
     def commit(self):
-        'Commit current changes to the database.'
+        '''Commit current changes to the database.
+
+        Only objects which have changed are written, unless
+            conf.db_dirty_root is set, in which case the root
+            is written every time also.
+
+        If conf.group_commit is set (and the server is running) the
+            changes are only marked with a savepoint, and all of the
+            changes made in the next conf.group_commit_window seconds
+            are written together in one transaction by flush().
+
+        While the database is held (see hold()) the changes are only
+            marked with a savepoint.
+
+        '''
+
+        if self._held:
+            self._savepoint = transaction.savepoint(optimistic=True)
+        elif conf.group_commit and reactor.running:
+            self._savepoint = transaction.savepoint(optimistic=True)
+            if self._flush_call is None:
+                self._flush_call = reactor.callLater(conf.group_commit_window,
+                                                        self.flush)
+        else:
+            self._commit()
 
-        self.root._p_changed = 1
+    def _commit(self):
+        if conf.db_dirty_root:
+            self.root._p_changed = 1
         transaction.commit()
+
+        self.last_commit = time.time()
         #print 'db COMMIT'
 
+    def flush(self):
+        'Write out any changes waiting for a group commit.'
+
+        if self._flush_call is not None:
+            if self._flush_call.active():
+                self._flush_call.cancel()
+            self._flush_call = None
+
+        if self._savepoint is not None:
+            self._savepoint = None
+            try:
+                self._commit()
+            except:
+                print 'db FLUSH FAILED'
+                transaction.abort()
+                raise
+
     def abort(self):
-        'Abort the current database transaction, discarding all changes.'
+        '''Abort the current database transaction, discarding all changes.
 
-        transaction.abort()
+        With group commit, or while the database is held, only the
+            changes made since the last commit() are discarded.
+
+        '''
+
+        if self._savepoint is not None:
+            self._savepoint.rollback()
+        else:
+            transaction.abort()
+
+    def hold(self):
+        '''Run a batch of changes which will be committed together.
+
+        Until release() is called, commit() only takes a savepoint and
+            abort() rolls back to the last one, so code in the batch
+            which commits or aborts does not split the batch. Use
+            savepoint() and rollback() to undo one part of the batch.
+
+        '''
+
+        if not self._held:
+            self._unheld = self._savepoint
+        self._held += 1
+
+    def release(self):
+        '''End a batch started with hold(). The changes still need to
+            be committed (or aborted).
+
+        '''
+
+        self._held -= 1
+        if not self._held:
+            self._savepoint = self._unheld
+            self._unheld = None
+
+    def savepoint(self):
+        'Return a savepoint to use with rollback().'
+
+        sp = transaction.savepoint(optimistic=True)
+        if self._held:
+            self._savepoint = sp
+        return sp
+
+    def rollback(self, sp):
+        '''Undo the changes made since the savepoint sp. While held,
+            abort() will then roll back to sp.
+
+        '''
+
+        sp.rollback()
+        if self._held:
+            self._savepoint = sp
 
     def pack(self):
-        'Pack the DB to remove old versions, like vacuum.'
+        '''Pack the DB to remove old versions, like vacuum.
+
+        Returns a dict with the time taken and the number of bytes
+            reclaimed, which is also kept as self.pack_stats.
+
+        '''
 
-        import time
-        self.storage.pack(time.time(), serialize.referencesf)
-        print 'DB Packed'
+        start = time.time()
+        before = self.storage.getSize()
+        self.storage.pack(start, serialize.referencesf)
+        after = self.storage.getSize()
+        end = time.time()
+
+        self.packed_size = after
+        self.pack_stats = dict(time=end,
+                                duration=end-start,
+                                reclaimed=before-after,
+                                size=after,
+                                count=self.pack_stats.get('count', 0)+1)
+        print 'DB Packed %.2fs %s bytes reclaimed' % (end-start,
+                                                        before-after)
+        return self.pack_stats
+
+    def pack_due(self):
+        '''Return the reason the DB should be packed now, or None.
+
+        The DB is due for packing if it has grown by more than
+            conf.pack_growth bytes since it was last packed, or if it
+            has grown at all and there have been no commits for
+            conf.pack_idle seconds.
+
+        '''
+
+        growth = self.storage.getSize() - self.packed_size
+        if growth > conf.pack_growth:
+            return 'growth'
+        elif growth > 0 and time.time()-self.last_commit > conf.pack_idle:
+            return 'idle'
+        else:
+            return None
+
+    def pack_background(self):
+        '''Pack the DB in a thread, so the server keeps running.
+
+        Returns a Deferred which fires with the pack stats, or None
+            if there is already a pack running.
+
+        '''
+
+        if self.packing:
+            return None
+
+        from twisted.internet.threads import deferToThread
+        self.packing = True
+        d = deferToThread(self.pack)
+        def done(result):
+            self.packing = False
+            return result
+        d.addBoth(done)
+        return d
 
     def pack_regularly(self):
-        'Pack the DB every pack_interval seconds.'
+        'Check every conf.pack_check_interval seconds if the DB needs packing.'
 
-        self.pack()
-        pack_interval = 600 #seconds (10 minutes)
-        reactor.callLater(pack_interval, self.pack_regularly)
+        if not self.packing and self.pack_due() is not None:
+            d = self.pack_background()
+            d.addErrback(self._pack_failed)
+        reactor.callLater(conf.pack_check_interval, self.pack_regularly)
+
+    def _pack_failed(self, failure):
+        print 'DB pack failed'
+        failure.printTraceback()
 
     def __str__(self):
         items = {}
@@ -133,17 +307,45 @@ class TZODB(object):
         return unicode(items)
 
 
+def _tzrepr(tree):
+    items = []
+    for k, v in tree.items():
+        try:
+            items.append(u'%s: %s' % (k, v.name))
+        except AttributeError:
+            items.append(unicode(k))
+    return '{' + ', '.join(items) + '}'
+
+
 class TZDict(PersistentDict):
     'Customized persistent dictionary.'
 
-    def __repr__(self):
-        items = []
-        for k, v in self.items():
-            try:
-                items.append(u'%s: %s' % (k, v.name))
-            except AttributeError:
-                items.append(unicode(k))
-        return '{' + ', '.join(items) + '}'
+    __repr__ = _tzrepr
+
+
+class TZIOBTree(IOBTree):
+    '''Customized BTree with integer keys.
+
+    Used for sections of the database keyed by id number. Unlike a
+        TZDict, adding or removing an entry only changes the bucket
+        holding that entry, not the whole mapping.
+
+    '''
+
+    __repr__ = _tzrepr
+
+    def get(self, key, default=None):
+        try:
+            return IOBTree.get(self, key, default)
+        except TypeError:
+            # key was not an integer (None, for instance)
+            return default
+
+
+class TZOOBTree(OOBTree):
+    'Customized BTree with object (string) keys.'
+
+    __repr__ = _tzrepr
 
 
 class TZIndex(object):
@@ -161,9 +363,14 @@ class TZIndex(object):
             zodb = db.TZODB()
             self.dbroot = zodb.root
 
+            # changed each time an entry is added or removed, so that
+            #   cached lookups (see TZContainer.contents) can tell when
+            #   they may be out of date
+            self.generation = 0
+
     def idx(self):
         '''Return the root of this index.
-        Should reference a TZDict or a PersistentDict.
+        Should reference a TZIOBTree (or a TZDict in older databases).
 
         '''
 
@@ -173,11 +380,13 @@ class TZIndex(object):
         'Insert an entry in to the index.'
 
         self.idx()[tzobj.tzid] = tzobj
+        self.generation += 1
 
     def remove(self, tzobj):
         'Delete the given entry from the index.'
 
         del self.idx()[tzobj.tzid]
+        self.generation += 1
 
     def get(self, tzid):
         'Return the entry with the given id number.'
@@ -185,12 +394,181 @@ class TZIndex(object):
         i = self.idx()
         return i.get(tzid, None)
 
+    def get_many(self, tzids):
+        '''Return a list of the entries with the given id numbers,
+            with None for any id number not in the index.
+
+        Any of the objects which are not yet loaded from the database
+            are requested together, if the database supports it,
+            instead of one at a time as they are used.
+
+        '''
+
+        i = self.idx()
+        objs = [i.get(tzid, None) for tzid in tzids]
+
+        jar = getattr(i, '_p_jar', None)
+        if jar is not None and hasattr(jar, 'prefetch'):
+            ghosts = [obj for obj in objs
+                        if obj is not None and obj._p_changed is None]
+            if ghosts:
+                jar.prefetch(ghosts)
+
+        return objs
+
     def ls(self):
         'Return a list of the objects referenced by the index.'
 
         idx = self.idx()
-        return idx.values()
+        return list(idx.values())
+
+
+class TZNameIndex(object):
+    '''Index of object names for one section of the database.
+
+    Maps each object name (and each name_aka alias if akas is True)
+        to the id numbers of the objects in the section using that
+        name, so that finding an object by name does not need to look
+        at every object in the section.
+
+    '''
+
+    articles = ('a ', 'an ', 'the ')
+
+    def __init__(self, section, akas=True):
+        self.section = section
+        self.akas = akas
 
+        zodb = TZODB()
+        self.dbroot = zodb.root
+
+    def idx(self):
+        '''Return the root of this index.
+
+        The index is built from the objects in the section the first
+            time it is needed, so that older databases get one too.
+
+        '''
+
+        names = self.dbroot.get('_names', None)
+        if names is None:
+            names = TZDict()
+            self.dbroot['_names'] = names
+
+        idx = names.get(self.section, None)
+        if idx is None:
+            self.rebuild()
+            idx = names[self.section]
+
+        return idx
+
+    def rebuild(self):
+        'Throw away the index for this section and build it again.'
+
+        names = self.dbroot['_names']
+        names[self.section] = TZOOBTree()
+        for obj in self.dbroot[self.section].values():
+            self.add(obj)
+
+    def names(self, obj):
+        'Return the list of names obj should be found by.'
+
+        names = [obj.name]
+        if self.akas:
+            names.extend(obj.name_aka)
+        return names
+
+    def add(self, obj):
+        'Insert entries for all of the names of obj.'
+
+        idx = self.idx()
+        for name in self.names(obj):
+            tzids = idx.get(name, None)
+            if tzids is None:
+                tzids = IITreeSet()
+                idx[name] = tzids
+            tzids.insert(obj.tzid)
+
+    def remove(self, obj):
+        'Delete the entries for all of the names of obj.'
+
+        idx = self.idx()
+        for name in self.names(obj):
+            tzids = idx.get(name, None)
+            if tzids is not None and obj.tzid in tzids:
+                tzids.remove(obj.tzid)
+                if not len(tzids):
+                    del idx[name]
+
+    def find(self, name):
+        '''Return a list of the id numbers of objects with the given name.
+
+        Also finds objects by the name after removing any included
+            article. For instance, "the hat" will find objects named
+            "the hat" first, then objects named "hat".
+
+        '''
+
+        idx = self.idx()
+        tzids = list(idx.get(name, ()))
+        for article in self.articles:
+            if name.startswith(article):
+                aname = name[len(article):]
+                for tzid in idx.get(aname, ()):
+                    if tzid not in tzids:
+                        tzids.append(tzid)
+        return tzids
+
+
+mutable_types = (list, dict, set)
+
+def find_mutables():
+    '''Return a list of (holder, attribute, type name) for each plain
+        list, dict or set held by the database root, by an indexed
+        object, or by a persistent container held by an indexed object.
+
+    Changes made in place to a plain container are not saved unless
+        the object holding it is also marked as changed. Use the
+        persistent versions (PersistentList, PersistentDict) instead.
+
+    '''
+
+    import db
+    zodb = db.TZODB()
+    dbroot = zodb.root
+
+    found = []
+
+    def check(holder, name, val):
+        if isinstance(val, mutable_types):
+            found.append((holder, name, type(val).__name__))
+            return True
+        return False
+
+    for k, v in dbroot.items():
+        check('root', k, v)
+
+    for obj in TZIndex().ls():
+        state = obj.__getstate__()
+        if not isinstance(state, dict):
+            continue
+        for name, val in state.items():
+            if name == '_vals':
+                # plain dict on purpose (see share.setting_attr), but
+                #   the values in it must not be changed in place
+                for k, v in val.items():
+                    check(obj, '%s[%r]' % (name, k), v)
+                continue
+            if check(obj, name, val):
+                continue
+            if isinstance(val, PersistentDict):
+                for k, v in val.items():
+                    check(obj, '%s[%r]' % (name, k), v)
+            elif isinstance(val, PersistentList):
+                for i, v in enumerate(val):
+                    check(obj, '%s[%s]' % (name, i), v)
+
+    return found
 
 def db_init():
     print 'initializing ZODB'
@@ -202,7 +580,7 @@ def db_init():
     dbroot['DB_VERSION'] = DB_VERSION
 
 
-    dbroot['_index'] = db.TZDict()
+    dbroot['_index'] = db.TZIOBTree()
 
 
     dbroot['share'] = db.TZDict()
@@ -210,10 +588,10 @@ def db_init():
     zodb.commit()
 
 
-    dbroot['rooms'] = db.TZDict()
+    dbroot['rooms'] = db.TZIOBTree()
     zodb.commit()
 
-    dbroot['exits'] = db.TZDict()
+    dbroot['exits'] = db.TZIOBTree()
     zodb.commit()
 
 
@@ -226,11 +604,11 @@ def db_init():
                         destination=house)
 
 
-    dbroot['players'] = db.TZDict()
-    dbroot['players']['_index'] = db.TZDict()
+    dbroot['players'] = db.TZOOBTree()
+    dbroot['players']['_index'] = db.TZIOBTree()
     zodb.commit()
 
-    dbroot['items'] = db.TZDict()
+    dbroot['items'] = db.TZIOBTree()
     import items
     rose = items.Rose()
     house.add(rose)
@@ -239,10 +617,69 @@ def db_init():
     dbroot['admin'] = PersistentList()
     dbroot['wizard'] = PersistentList()
 
-    dbroot['mobs'] = db.TZDict()
+    dbroot['mobs'] = db.TZIOBTree()
 
     zodb.commit()
 
+def upgrade(from_version, to_version):
+    '''Upgrade the layout of the database root itself.
+
+    Version 5 moves the sections of the database keyed by id number
+        from TZDict to TZIOBTree, the players section to TZOOBTree,
+        and the name indexes to TZOOBTree of IITreeSet.
+
+    Version 6 keeps the settings of each object in its _vals dict,
+        only where they differ from the class defaults, and drops the
+        copy of the settings list each object used to have.
+
+    '''
+
+    if from_version==4 and to_version==5:
+        # use the classes from the db module, not __main__, or they
+        #   would be stored as __main__.TZIOBTree when run as a script
+        import db
+        zodb = db.TZODB()
+        dbroot = zodb.root
+
+        def convert(old, cls):
+            new = cls()
+            for k, v in old.items():
+                new[k] = v
+            return new
+
+        for section in '_index', 'rooms', 'exits', 'items', 'mobs':
+            print 'upgrading', section
+            dbroot[section] = convert(dbroot[section], db.TZIOBTree)
+
+        print 'upgrading players'
+        players = dbroot['players']
+        pindex = convert(players['_index'], db.TZIOBTree)
+        newplayers = db.TZOOBTree()
+        for name, player in players.items():
+            if name != '_index':
+                newplayers[name] = player
+        newplayers['_index'] = pindex
+        dbroot['players'] = newplayers
+
+        print 'upgrading name indexes'
+        # rebuilt with the new layout the next time they are needed
+        if '_names' in dbroot:
+            del dbroot['_names']
+
+        zodb.commit()
+
+    elif from_version==5 and to_version==6:
+        import db
+        import share
+        zodb = db.TZODB()
+        dbroot = zodb.root
+
+        print 'upgrading settings'
+        for obj in dbroot['_index'].values():
+            share.compact_settings(obj)
+
+        zodb.commit()
+
 def db_upgrade(from_version, to_version):
     print 'upgrading ZODB'
 
@@ -264,6 +701,13 @@ def db_upgrade(from_version, to_version):
         print '  Must upgrade from current version.'
         return
 
+    upgrade_step(zodb, from_version, to_version)
+
+def upgrade_step(zodb, from_version, to_version):
+    'Upgrade the open database zodb by one version.'
+
+    upgrade(from_version, to_version)
+
     for mod in 'players', 'mobs', 'items', 'rooms', 'exits':
         module = __import__(mod)
         if hasattr(module, 'upgrade'):
@@ -315,7 +759,7 @@ def db_depopulate():
     zodb = TZODB(fname)
     dbroot = zodb.root
 
-    names = dbroot['players'].keys()
+    names = list(dbroot['players'].keys())
     for name in names:
         if name == '_index':
             continue
@@ -339,6 +783,96 @@ def db_depopulate():
     for pth in pths:
         os.remove(pth)
 
+def db_check():
+    if len(sys.argv) == 2:
+        fname = None
+    elif len(sys.argv) == 3:
+        fname = sys.argv[2]
+    else:
+        print 'Usage: db.py check [filename]'
+        sys.exit(1)
+
+    print 'Checking DB for non-persistent containers'
+    import db
+    zodb = db.TZODB(fname, read_only=True)
+
+    found = db.find_mutables()
+    for holder, name, typ in found:
+        print '  %s: %s (%s)' % (unicode(holder), name, typ)
+    print len(found), 'found'
+
+def db_settings_bench():
+    '''Compare the size of a database before and after the upgrade to
+        compact settings (version 5 to version 6).
+
+    Works on a copy of the given backup file (by default the world
+        shipped in 0.Data.fs). If the copy is older than version 5 it
+        is first upgraded one version at a time, the same way as
+        db_upgrade does it. Reports the
+        packed size of the file, the number of records, and the number
+        of objects and bytes loaded to read every setting of every object.
+
+    '''
+
+    if len(sys.argv) == 2:
+        fname = '0.%s' % datafsname
+    elif len(sys.argv) == 3:
+        fname = sys.argv[2]
+    else:
+        print 'Usage: db.py settingsbench [filename]'
+        sys.exit(1)
+
+    import glob
+    import shutil
+    benchname = 'settingsbench.%s' % datafsname
+    benchpath = '%s/%s' % (backupdir, benchname)
+    shutil.copy('%s/%s' % (backupdir, fname), benchpath)
+
+    import db
+    zodb = db.TZODB(benchname)
+    try:
+        version = zodb.version()
+        if version > 5:
+            print 'Database must be at version 5 or less. This is version', version
+            return
+        while version < 5:
+            print 'upgrading copy from version', version, 'to', version + 1
+            upgrade_step(zodb, version, version + 1)
+            version += 1
+
+        def measure():
+            zodb.storage.pack(time.time(), serialize.referencesf)
+            size = zodb.storage.getSize()
+            records = len(zodb.storage)
+
+            zodb.conn.cacheMinimize()
+            start = time.time()
+            for obj in zodb.root['_index'].values():
+                for name in obj.settings:
+                    obj.setting(name)
+            elapsed = time.time() - start
+
+            loaded = zodb.conn._cache.lru_items()
+            nbytes = 0
+            for oid, obj in loaded:
+                nbytes += len(zodb.storage.load(oid, '')[0])
+            return size, records, len(loaded), nbytes, elapsed
+
+        before = measure()
+        upgrade(5, 6)
+        after = measure()
+
+        print '%-24s %12s %12s' % ('', 'version 5', 'version 6')
+        for i, label in enumerate(('Data.fs bytes (packed)', 'records',
+                                    'objects loaded', 'bytes loaded')):
+            print '%-24s %12d %12d' % (label, before[i], after[i])
+        print '%-24s %12.3f %12.3f' % ('seconds to read', before[4], after[4])
+
+    finally:
+        zodb.close()
+        for pth in glob.glob('%s*' % benchpath):
+            os.remove(pth)
+
 def db_display(fname=None):
     import db
     zodb = db.TZODB(fname, read_only=True)
@@ -358,6 +892,10 @@ if __name__ == '__main__':
         db_pack()
     elif len(sys.argv) > 1 and sys.argv[1] == 'depopulate':
         db_depopulate()
+    elif len(sys.argv) > 1 and sys.argv[1] == 'check':
+        db_check()
+    elif len(sys.argv) > 1 and sys.argv[1] == 'settingsbench':
+        db_settings_bench()
     elif len(sys.argv) > 1:
         fname = sys.argv[1]
         print 'Reading backup ZODB', fname
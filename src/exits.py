@@ -22,10 +22,11 @@ Exits are portals between rooms.
 '''
 
 from persistent.list import PersistentList
+from BTrees.IIBTree import IITreeSet
 
 from share import TZObj
 
-from db import TZODB, TZIndex
+from db import TZODB, TZIndex, TZNameIndex, TZDict, TZIOBTree, TZOOBTree
 zodb = TZODB()
 dbroot = zodb.root
 commit = zodb.commit
@@ -36,6 +37,7 @@ import players
 from colors import green, yellow, red
 
 tzindex = TZIndex()
+nameindex = TZNameIndex('exits', akas=False)
 
 
 def get(xid):
@@ -47,10 +49,12 @@ def add(x):
     'Add the given exit to the database.'
 
     dbroot['exits'][x.tzid] = x
+    nameindex.add(x)
 
 def remove(x):
     'Remove the given exit from the database.'
 
+    nameindex.remove(x)
     del dbroot['exits'][x.tzid]
 
 def getname(name, all=False):
@@ -64,8 +68,9 @@ def getname(name, all=False):
     '''
 
     result = []
-    for x in ls():
-        if x.name == name:
+    for xid in nameindex.find(name):
+        x = get(xid)
+        if x is not None:
             if not all:
                 return x
             else:
@@ -79,7 +84,7 @@ def getname(name, all=False):
 def ls():
     'Return a list of all the exits in the database.'
 
-    return dbroot['exits'].values()
+    return list(dbroot['exits'].values())
 
 def names():
     '''Return a list of the names of all the exits in the database.
@@ -95,6 +100,96 @@ def isexit(obj):
     return obj in ls()
 
 
+def links():
+    '''Return the exit link index.
+
+    The index has two parts:
+        'routes' maps (room id, destination id) to the ids of the exits
+            in that room which lead to that destination.
+        'incoming' maps each destination id to the ids of all of the
+            exits which lead there.
+
+    It is kept up to date by the Exit room and destination setters,
+        and is built from all of the exits the first time it is needed,
+        so that older databases get one too.
+
+    '''
+
+    idx = dbroot.get('_exitlinks', None)
+    if idx is None:
+        idx = rebuild_links()
+    return idx
+
+def rebuild_links():
+    'Throw away the exit link index and build it again.'
+
+    idx = TZDict()
+    idx['routes'] = TZOOBTree()
+    idx['incoming'] = TZIOBTree()
+    dbroot['_exitlinks'] = idx
+    for x in dbroot['exits'].values():
+        _link(x)
+    return idx
+
+def _link(x):
+    'Add the index entries for exit x.'
+
+    rid = getattr(x, '_rid', None)
+    destid = getattr(x, '_destid', None)
+    if destid is None:
+        return
+
+    idx = links()
+    _insert(idx['incoming'], destid, x.tzid)
+    if rid is not None:
+        _insert(idx['routes'], (rid, destid), x.tzid)
+
+def _unlink(x):
+    'Remove the index entries for exit x.'
+
+    rid = getattr(x, '_rid', None)
+    destid = getattr(x, '_destid', None)
+    if destid is None:
+        return
+
+    idx = links()
+    _discard(idx['incoming'], destid, x.tzid)
+    if rid is not None:
+        _discard(idx['routes'], (rid, destid), x.tzid)
+
+def _insert(tree, key, xid):
+    xids = tree.get(key)
+    if xids is None:
+        xids = IITreeSet()
+        tree[key] = xids
+    xids.insert(xid)
+
+def _discard(tree, key, xid):
+    xids = tree.get(key)
+    if xids is not None and xid in xids:
+        xids.remove(xid)
+        if not len(xids):
+            del tree[key]
+
+def route(room, destination):
+    '''Return an exit in room which leads to destination, or None if
+        there is no such exit.
+
+    '''
+
+    xids = links()['routes'].get((room.tzid, destination.tzid))
+    if xids:
+        return get(xids.minKey())
+    else:
+        return None
+
+def incoming(room):
+    'Return a list of all of the exits which lead in to room.'
+
+    xids = links()['incoming'].get(room.tzid, ())
+    return [get(xid) for xid in xids]
+
+
 class Exit(TZObj):
     'A way to move from one room to another.'
 
@@ -163,6 +258,7 @@ class Exit(TZObj):
 
         if self.room is not None:
             self.room.rmexit(self)
+        _unlink(self)
         remove(self)
         TZObj.destroy(self)
 
@@ -271,10 +367,12 @@ class Exit(TZObj):
 
     def _set_room(self, room):
         'Setter for the room property.'
+        _unlink(self)
         if room is not None:
             self._rid = room.tzid
         else:
             self._rid = None
+        _link(self)
     def _get_room(self):
         'Getter for the room property.'
         return rooms.get(self._rid)
@@ -282,10 +380,12 @@ class Exit(TZObj):
 
     def _set_destination(self, destination):
         'Setter for the destination property.'
+        _unlink(self)
         if destination is not None:
             self._destid = destination.tzid
         else:
             self._destid = None
+        _link(self)
     def _get_destination(self):
         'Getter for the destination property.'
         return rooms.get(self._destid)
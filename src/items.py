@@ -30,17 +30,20 @@ from twisted.internet import reactor
 
 from persistent.list import PersistentList
 
-from db import TZODB, TZIndex
+from db import TZODB, TZIndex, TZNameIndex
 dbroot = TZODB().root
 
-from share import TZObj, TZContainer
+from share import TZObj, TZContainer, index_names, unindex_names
 from share import register_plugin
 
 import wizard
 import players
 import mobs
+import timers
 from colors import green
 
+nameindex = TZNameIndex('items')
+
 
 def get(iid):
     'Return the item with the given id number.'
@@ -51,10 +54,12 @@ def add(item):
     'Add the given item to the database.'
 
     dbroot['items'][item.tzid] = item
+    nameindex.add(item)
 
 def remove(item):
     'Remove the given item from the database.'
 
+    nameindex.remove(item)
     del dbroot['items'][item.tzid]
 
 def getname(name, all=False):
@@ -67,23 +72,24 @@ def getname(name, all=False):
 
     '''
 
-    result = set()
-    for item in ls():
-        if item.name == name or name in item.name_aka:
+    result = []
+    for iid in nameindex.find(name):
+        item = get(iid)
+        if item is not None:
             if not all:
                 return item
             else:
-                result.add(item)
+                result.append(item)
 
     if all:
-        return list(result)
+        return result
     else:
         return None
 
 def ls():
     'Return a list of all the items in the database.'
 
-    return dbroot['items'].values()
+    return list(dbroot['items'].values())
 
 def names():
     '''Return a list of the names of all the items in the database.
@@ -330,11 +336,11 @@ class InvRing(Ring):
         character.setting('visible', vis)
 
     def wear(self, character):
-        reactor.callLater(0.4, self._set_visible, character, False)
+        timers.later(self, '_set_visible', 0.4, character, False)
         return True
 
     def unwear(self, character):
-        reactor.callLater(0.4, self._set_visible, character, True)
+        timers.later(self, '_set_visible', 0.4, character, True)
         return True
 
 class CursedItem(Item):
@@ -440,14 +446,16 @@ class Coin(Item):
     name = property(_get_name, _set_name)
 
     def _set_n_coins(self, n):
+        unindex_names(self)
         self._n_coins = n
+        index_names(self)
 
     def add_coins(self, n):
-        self._n_coins += n
+        self._set_n_coins(self._n_coins + n)
 
     def remove_coins(self, n):
         if n <= self._n_coins:
-            self._n_coins -= n
+            self._set_n_coins(self._n_coins - n)
         else:
             raise ValueError
 
@@ -590,7 +598,7 @@ class TimeTrap(Trap):
 
     def activate(self):
         delay = self.setting('delay')
-        reactor.callLater(delay, self.spring)
+        timers.later(self, 'spring', delay)
 
 class GetTimeTrap(TimeTrap, GetTrap):
     'TimeTrap activated by getting it.'
@@ -31,13 +31,14 @@ from twisted.internet import reactor
 from persistent.list import PersistentList
 from persistent.dict import PersistentDict
 
-from db import TZODB, TZIndex
+from db import TZODB, TZIndex, TZNameIndex
 zodb = TZODB()
 dbroot = zodb.root
 abort = zodb.abort
 commit = zodb.commit
 
 import tzprotocol
+import ticker
 
 import rooms
 import exits
@@ -47,6 +48,8 @@ from share import TZContainer, Character, class_as_string, int_attr, str_attr
 from share import register_plugin
 from colors import magenta
 
+nameindex = TZNameIndex('mobs')
+
 
 def get(mid):
     'Return the mob with the given id number.'
@@ -57,10 +60,12 @@ def add(mob):
     'Add the given mob to the database.'
 
     dbroot['mobs'][mob.tzid] = mob
+    nameindex.add(mob)
 
 def remove(mob):
     'Remove the given mob from the database.'
 
+    nameindex.remove(mob)
     del dbroot['mobs'][mob.tzid]
 
 def getname(name, all=False):
@@ -74,8 +79,9 @@ def getname(name, all=False):
     '''
 
     result = []
-    for mob in ls():
-        if mob.name == name or name in mob.name_aka:
+    for mid in nameindex.find(name):
+        mob = get(mid)
+        if mob is not None:
             if not all:
                 return mob
             else:
@@ -89,7 +95,7 @@ def getname(name, all=False):
 def ls():
     'Return a list of all the mobs in the database.'
 
-    return dbroot['mobs'].values()
+    return list(dbroot['mobs'].values())
 
 def names():
     '''Return a list of the names of all the mobs in the database.
@@ -144,6 +150,7 @@ class Mob(Character):
             room.action(dict(act='destroy_mob', actor=None, mob=self))
 
         remove(self)
+        ticker.unschedule(self)
         Character.destroy(self)
 
     def __str__(self):
@@ -224,39 +231,31 @@ Mob: %s (%s) [in room %s]: %s
         return getattr(self, meth_name)
 
     def act(self):
-        'Choose an action and call it.'
+        '''Choose an action and call it.
+
+        Called regularly by the ticker, which takes care of committing
+            the changes, or rolling them back if there is an error, and
+            of scheduling the next call.
+
+        '''
 
         # mob may have been recently destroyed...
         if not self.exists():
             return
 
         action = self.action()
-        try:
-            if self.awake or action == self.action_awake:
-                action()
+        if self.awake or action == self.action_awake:
+            action()
 
-            self._last_act = time.time()
-
-        except:
-            #print 'mob.act ABORT'
-            abort()
-            #raise
-
-        else:
-            #print 'mob.act COMMIT'
-            commit()
-
-        reactor.callLater(self.period, self.act)
+        self._last_act = time.time()
 
     def nudge(self, delayfactor=10):
-        'Make sure the mob is calling act() regularly.'
-
-        now = time.time()
+        'Make sure the mob is scheduled to act regularly.'
 
-        if now > self._last_act + self.period * delayfactor:
-            reactor.callLater(self.period, self.act)
+        if not ticker.scheduled(self):
+            ticker.schedule(self, self.period)
         else:
-            print 'Mob acted too recently to nudge.'
+            print 'Mob already scheduled to act.'
 
 
     def action_sleep(self):
@@ -21,13 +21,29 @@
 There is a parser for general commands, and one for wizard commands.
 
 Run the module for a simple interface to test what the output of the
-parser will be for given inputs.
+parser will be for given inputs, or run it with the argument "bench"
+[<rounds>] to compare the speed of parse_line with full_parser, or
+with "corpus" [<file>] [--packrat] to report parse times for each rule
+over a file of command lines (one per line).
 
 '''
 
-from pyparsing import Word, alphas, nums, alphanums, printables, oneOf, OneOrMore, Optional, CaselessLiteral, ParseException, LineEnd, replaceWith, Suppress, Combine, Empty, restOfLine, SkipTo, FollowedBy, alphas8bit
+from pyparsing import Word, alphas, nums, alphanums, printables, oneOf, OneOrMore, Optional, CaselessLiteral, ParseException, LineEnd, replaceWith, Suppress, Combine, Empty, restOfLine, SkipTo, FollowedBy, alphas8bit, MatchFirst, ParserElement
+
+if __name__ == '__main__':
+    import os
+    import sys
+
+    etc = os.path.abspath('etc')
+    sys.path.append(etc)
 
 import conf
+from cache import LRUCache
+from stats import percentile
+
+if conf.parse_packrat:
+    ParserElement.enablePackrat()
+
 if conf.allow_utf8:
     low_unicode = u''.join(unichr(c) for c in xrange(1024)
                                         if not unichr(c).isspace())
@@ -197,7 +213,7 @@ set0_verb = CaselessLiteral('set')('verb')
 set1_verb = CaselessLiteral('set ')('verb')
 set1_verb.setParseAction(replaceWith('set'))
 set_var = Word(alphas)('var')
-set_val = Word(alphas)('val')
+set_val = Word(alphanums)('val')
 set0 = set0_verb + LineEnd()
 set1 = set1_verb + set_var + Optional('=' + set_val) + LineEnd()
 set = set0 | set1
@@ -225,10 +241,45 @@ catchall = Word(alphanums)('verb') + Optional(words)('rest') + LineEnd()
 section = Empty()('section')
 section.setParseAction(replaceWith('actions'))
 
-if conf.talkmode:
-    actions_parser = section + (info | time | take | get | drop | put | inventory | wear | remove | use | lock | listen | look | unlock | follow | exits | say | tell | shout | emote | quit_ | who | stats | set | unset | password | xyzzy | help | go | catchall)
-else:
-    actions_parser = section + (info | time | take | get | drop | put | inventory | wear | remove | use | lock | listen | look | unlock | follow | exits | say | shout | emote | quit_ | who | stats | set | unset | password | xyzzy | help | go | catchall)
+# Each rule is a grammar, followed by the verbs it can start with.
+#   The words are used by parse_line to skip the rules which cannot
+#   possibly match a given line.
+action_rules = [
+    (info, 'info'),
+    (time, 'time'),
+    (take, 'take remove'),
+    (get, 'get take'),
+    (drop, 'drop'),
+    (put, 'put'),
+    (inventory, 'inventory inv i'),
+    (wear, 'wear'),
+    (remove, 'remove'),
+    (use, 'use'),
+    (lock, 'lock'),
+    (listen, 'listen'),
+    (look, 'look l'),
+    (unlock, 'unlock'),
+    (follow, 'follow'),
+    (exits, 'exits'),
+    (say, 'say "'),
+    (tell, 'tell'),
+    (shout, 'shout'),
+    (emote, 'emote :'),
+    (quit_, 'quit'),
+    (who, 'who'),
+    (stats, 'stats'),
+    (set, 'set'),
+    (unset, 'unset'),
+    (password, 'password'),
+    (xyzzy, 'xyzzy'),
+    (help, 'help ?'),
+    (go, 'go enter'),
+]
+if not conf.talkmode:
+    action_rules.remove((tell, 'tell'))
+
+actions_parser = section + MatchFirst([r[0] for r in action_rules]
+                                        + [catchall])
 
 
 wiz = CaselessLiteral('@')('section')
@@ -324,22 +375,292 @@ destroy_verb = CaselessLiteral('destroy')('verb')
 destroy = destroy_verb + objref
 
 
-if not conf.talkmode:
-    wizard_parser = wiz + (info | teleport | summon | dig_ | lock1 | list_ | clone | study | tell | rename | short | long_ | destroy | wizset | wizunset | help | catchall)
-else:
-    wizard_parser = wiz + (info | teleport | summon | dig_ | lock1 | list_ | clone | study | rename | short | long_ | destroy | wizset | wizunset | help | catchall)
+wizard_rules = [
+    (info, 'info'),
+    (teleport, 'teleport'),
+    (summon, 'summon'),
+    (dig_, 'dig'),
+    (lock1, 'lock'),
+    (list_, 'list'),
+    (clone, 'clone'),
+    (study, 'study'),
+    (tell, 'tell'),
+    (rename, 'rename'),
+    (short, 'short'),
+    (long_, 'long'),
+    (destroy, 'destroy'),
+    (wizset, 'set'),
+    (wizunset, 'unset'),
+    (help, 'help ?'),
+]
+if conf.talkmode:
+    wizard_rules.remove((tell, 'tell'))
+
+wizard_parser = wiz + MatchFirst([r[0] for r in wizard_rules]
+                                    + [catchall])
 
 
 full_parser = actions_parser | wizard_parser
 
 
+class Dispatcher(object):
+    '''Fast path for parsing a line.
+
+    Looks at the start of the line to find the rules which could match
+        it, and tries only those (in their original order) followed by
+        the catchall. The result is the same as using the full parser.
+
+    Grammars for each combination of rules are built the first time
+        they are needed and kept for later.
+
+    '''
+
+    def __init__(self, prefix, rules):
+        self.prefix = prefix
+        self.rules = []
+        self.byfirst = {}
+        for n, (rule, verbs) in enumerate(rules):
+            verbs = tuple(v.lower() for v in verbs.split())
+            self.rules.append((rule, verbs))
+            for first in dict.fromkeys(v[0] for v in verbs):
+                # (note: set is one of the grammars in this module)
+                self.byfirst.setdefault(first, []).append(n)
+        self.grammars = {}
+
+    def candidates(self, text):
+        'Return a tuple of the numbers of the rules which might match text.'
+
+        low = text.lower()
+        if not low:
+            return ()
+        return tuple(n for n in self.byfirst.get(low[0], ())
+                        if low.startswith(self.rules[n][1]))
+
+    def rule_name(self, text, key=None):
+        '''Return the name (first verb) of the rule which matches text,
+            "catchall", or None if nothing matches.
+
+        key is the text used to pick the candidate rules, if that is not
+            all of text (text without the "@" prefix, for wizard lines).
+
+        '''
+
+        if key is None:
+            key = text
+        for n in self.candidates(key):
+            rule, verbs = self.rules[n]
+            try:
+                (self.prefix + rule).parseString(text)
+            except ParseException:
+                continue
+            return verbs[0]
+        try:
+            (self.prefix + catchall).parseString(text)
+        except ParseException:
+            return None
+        return 'catchall'
+
+    def grammar(self, text):
+        'Return the grammar to use for parsing text.'
+
+        cands = self.candidates(text)
+        grammar = self.grammars.get(cands)
+        if grammar is None:
+            rules = [self.rules[n][0] for n in cands]
+            grammar = self.prefix + MatchFirst(rules + [catchall])
+            self.grammars[cands] = grammar
+        return grammar
+
+
+action_dispatcher = Dispatcher(section, action_rules)
+wizard_dispatcher = Dispatcher(wiz, wizard_rules)
+
+parse_cache = LRUCache(conf.parse_cache_size)
+
+def parse_line(line):
+    '''Parse a line of input.
+
+    Returns the same results as full_parser.parseString(line), and
+        raises ParseException in the same way, but faster.
+
+    Results for short lines (which are mostly the common commands like
+        "look" or "n") are cached.
+
+    '''
+
+    cacheable = len(line) <= conf.parse_cache_line_length
+    if cacheable:
+        cached = parse_cache.get(line)
+        if cached is not None:
+            if isinstance(cached, ParseException):
+                raise cached
+            return cached
+
+    text = line.lstrip()
+    if text.startswith('@'):
+        grammar = wizard_dispatcher.grammar(text[1:].lstrip())
+    else:
+        grammar = action_dispatcher.grammar(text)
+
+    try:
+        result = grammar.parseString(line)
+    except ParseException, e:
+        if cacheable:
+            parse_cache[line] = e
+        raise
+
+    if cacheable:
+        parse_cache[line] = result
+    return result
+
+
+
+bench_lines = [
+    'look', 'l', 'n', 's', 'inventory', 'i', 'look at rose', 'l rose',
+    'get rose', 'take 2 coins from bag', 'drop rose', 'put rose in bag',
+    'say hello there', '"hi', 'emote waves', ':smiles', 'who', 'exits',
+    'go north', 'north', 'the light', 'info', 'info #12', 'help',
+    'help look', 'wear hat', 'remove hat', 'use key on door',
+    'lock door with key', 'unlock door', 'follow bob', 'listen to bob',
+    'set', 'set color=on', 'unset color', 'stats', 'time', 'xyzzy',
+    'shout HELLO', 'quit', 'frobnicate the widget',
+    '@info', '@teleport house', '@dig north to new room return by south',
+    '@list rooms', '@clone rose as big rose', '@study Rose',
+    '@rename #5 to flower', '@short for rose is A lovely red rose.',
+    '@destroy #42', '@set period on house to 10', '@unset period on house',
+    '@help', '@summon bob', '@zap',
+]
+
+def bench(rounds=200):
+    '''Compare parse_line with full_parser on a set of typical lines.
+
+    Checks first that both give the same results, then reports the
+        number of lines per second for full_parser, for parse_line
+        without its cache, and for parse_line with the cache.
+
+    '''
+
+    import time
+
+    def parse_full(line):
+        return full_parser.parseString(line)
+
+    def parse_nocache(line):
+        parse_cache.clear()
+        return parse_line(line)
+
+    def result(parse, line):
+        try:
+            r = parse(line)
+        except ParseException:
+            return None
+        return r.asList(), r.asDict()
+
+    mismatch = 0
+    for line in bench_lines:
+        if result(parse_full, line) != result(parse_nocache, line):
+            print 'MISMATCH', repr(line)
+            mismatch += 1
+    print len(bench_lines), 'lines checked,', mismatch, 'mismatches'
+
+    nlines = len(bench_lines) * rounds
+    parse_cache.clear()
+    for name, parse in (('full_parser', parse_full),
+                        ('parse_line (no cache)', parse_nocache),
+                        ('parse_line', parse_line)):
+        start = time.time()
+        for i in xrange(rounds):
+            for line in bench_lines:
+                try:
+                    parse(line)
+                except ParseException:
+                    pass
+        elapsed = time.time() - start
+        print '%-24s %10.0f lines/s' % (name, nlines/elapsed)
+
+    print 'cache', parse_cache.stats()
+
+def corpus(fname=None, rounds=20):
+    '''Replay the command lines in file fname (or bench_lines if no
+        file is given) and report the parse latency for each rule.
+
+    Each line is parsed rounds times with parse_line, with the cache
+        cleared so that every parse is measured.
+
+    '''
+
+    import time
+
+    if fname is not None:
+        lines = [line.strip() for line in open(fname)]
+        lines = [line.decode('utf-8') for line in lines if line]
+    else:
+        lines = bench_lines
+
+    bysection = {}
+    for line in lines:
+        text = line.lstrip()
+        if text.startswith('@'):
+            name = wizard_dispatcher.rule_name(text, text[1:].lstrip())
+            if name is not None:
+                name = '@' + name
+        else:
+            name = action_dispatcher.rule_name(text)
+        bysection.setdefault(name or '(no match)', []).append(line)
+
+    print 'packrat', ParserElement._packratEnabled
+    print '%-16s %6s %9s %9s %9s %9s' % ('rule', 'count',
+                                    'p50 ms', 'p90 ms', 'p99 ms', 'max ms')
+    everything = []
+    for name in sorted(bysection):
+        times = []
+        for line in bysection[name]:
+            for i in xrange(rounds):
+                parse_cache.clear()
+                start = time.time()
+                try:
+                    parse_line(line)
+                except ParseException:
+                    pass
+                times.append(time.time() - start)
+        times.sort()
+        everything.extend(times)
+        print '%-16s %6d %9.3f %9.3f %9.3f %9.3f' % (name, len(times),
+                    1000*percentile(times, 50), 1000*percentile(times, 90),
+                    1000*percentile(times, 99), 1000*times[-1])
+
+    everything.sort()
+    print '%-16s %6d %9.3f %9.3f %9.3f %9.3f' % ('ALL', len(everything),
+                1000*percentile(everything, 50),
+                1000*percentile(everything, 90),
+                1000*percentile(everything, 99), 1000*everything[-1])
+    print '%.0f lines/s' % (len(everything) / sum(everything))
+
 
 if __name__ == '__main__':
+    if '--packrat' in sys.argv:
+        sys.argv.remove('--packrat')
+        ParserElement.enablePackrat()
+
+    if len(sys.argv) > 1 and sys.argv[1] == 'corpus':
+        if len(sys.argv) > 2:
+            corpus(sys.argv[2])
+        else:
+            corpus()
+        sys.exit(0)
+
+    if len(sys.argv) > 1 and sys.argv[1] == 'bench':
+        if len(sys.argv) > 2:
+            bench(int(sys.argv[2]))
+        else:
+            bench()
+        sys.exit(0)
+
     cmd = ''
     while cmd != 'q':
         cmd = raw_input('::>')
         try:
-            p = full_parser.parseString(cmd)
+            p = parse_line(cmd)
             print p
             print p.asDict()
         except ParseException:
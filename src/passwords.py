@@ -0,0 +1,231 @@
+# Copyright 2008 Lee Harr
+#
+# This file is part of TZMud.
+#
+# TZMud is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# TZMud is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with TZMud.  If not, see <http://www.gnu.org/licenses/>.
+
+
+'''Password hashing.
+
+New hashes ({pw_v2}) use PBKDF2-HMAC-SHA256 with conf.password_iterations
+    rounds. Older {pw_v1} hashes (salted MD5) can still be checked, and
+    needs_upgrade() tells when a hash should be replaced.
+
+Hashing is slow on purpose, so the *_async functions run it in the
+    reactor thread pool and return a Deferred.
+
+Run the module with the argument "bench" [<logins>] to measure the
+    throughput and latency of a burst of logins, and how long the
+    reactor is kept waiting.
+
+'''
+
+import os
+import sys
+import hmac
+import hashlib
+import struct
+
+from twisted.internet import threads
+
+if __name__ == '__main__':
+    etc = os.path.abspath('etc')
+    sys.path.append(etc)
+
+import conf
+
+
+if hasattr(hashlib, 'pbkdf2_hmac'):
+    def pbkdf2(pwtext, salt, iterations):
+        'Return the PBKDF2-HMAC-SHA256 key for pwtext.'
+
+        return hashlib.pbkdf2_hmac('sha256', pwtext, salt, iterations)
+
+else:
+    def pbkdf2(pwtext, salt, iterations):
+        '''Return the PBKDF2-HMAC-SHA256 key for pwtext.
+
+        Pure Python version, for when hashlib does not have pbkdf2_hmac.
+
+        '''
+
+        mac = hmac.new(pwtext, None, hashlib.sha256)
+        def prf(data):
+            h = mac.copy()
+            h.update(data)
+            return h.digest()
+
+        u = prf(salt + struct.pack('!I', 1))
+        result = [ord(c) for c in u]
+        for i in xrange(iterations - 1):
+            u = prf(u)
+            for j, c in enumerate(u):
+                result[j] ^= ord(c)
+        return ''.join([chr(b) for b in result])
+
+
+def _encode(pwtext):
+    if isinstance(pwtext, unicode):
+        pwtext = pwtext.encode('utf-8')
+    return pwtext
+
+def hash_password(pwtext, iterations=None):
+    'Return a new {pw_v2} hash for pwtext.'
+
+    if iterations is None:
+        iterations = conf.password_iterations
+    salt = os.urandom(16).encode('hex')
+    key = pbkdf2(_encode(pwtext), salt, iterations)
+    return '{pw_v2}%s$%s$%s' % (iterations, salt, key.encode('hex'))
+
+def check_password(pwhash, pwtext):
+    'Return True if pwtext matches the hash pwhash.'
+
+    pwtext = _encode(pwtext)
+
+    if pwhash.startswith('{pw_v2}'):
+        iterations, salt, key = pwhash[7:].split('$')
+        check = pbkdf2(pwtext, salt, int(iterations)).encode('hex')
+        return _same(check, key)
+
+    elif pwhash.startswith('{pw_v1}'):
+        hasher = hashlib.md5()
+        hasher.update(pwtext)
+        salt = pwhash[-8:]
+        hasher.update(salt)
+        return _same(hasher.hexdigest(), pwhash[7:-8])
+
+    else:
+        raise SystemError
+
+def _same(a, b):
+    'Compare two strings, taking the same time wherever they differ.'
+
+    if len(a) != len(b):
+        return False
+    result = 0
+    for x, y in zip(a, b):
+        result |= ord(x) ^ ord(y)
+    return result == 0
+
+def needs_upgrade(pwhash):
+    'Return True if pwhash should be replaced by a new hash.'
+
+    if not pwhash.startswith('{pw_v2}'):
+        return True
+    iterations = int(pwhash[7:].split('$', 1)[0])
+    return iterations < conf.password_iterations
+
+def hash_password_async(pwtext):
+    'Hash pwtext in a thread. Returns a Deferred which fires with the hash.'
+
+    return threads.deferToThread(hash_password, pwtext)
+
+def check_password_async(pwhash, pwtext):
+    '''Check pwtext against pwhash in a thread. Returns a Deferred which
+        fires with True or False.
+
+    '''
+
+    return threads.deferToThread(check_password, pwhash, pwtext)
+
+
+def bench(logins=50):
+    '''Check logins passwords at once, first one after the other in the
+        reactor thread, then all together in the thread pool.
+
+    Reports logins per second, the latency of each login (from the
+        start of the burst until its check finished) and the longest
+        time the reactor went without running a 10ms timer.
+
+    '''
+
+    import time
+    from twisted.internet import reactor, task, defer
+    from stats import percentile
+
+    pwhash = hash_password('secret')
+    print 'PBKDF2 iterations:', conf.password_iterations,
+    print ' thread pool size:', reactor.getThreadPool().max
+
+    def report(name, start, latencies, stalls):
+        elapsed = time.time() - start
+        latencies.sort()
+        print '%-10s %6.1f logins/s  latency ms: p50 %6.1f  p95 %6.1f  max %6.1f  reactor stall ms: %6.1f' % (
+                name, logins / elapsed,
+                1000 * percentile(latencies, 50),
+                1000 * percentile(latencies, 95),
+                1000 * latencies[-1],
+                1000 * max(stalls))
+
+    def watch():
+        stalls = [0]
+        last = [time.time()]
+        def tick():
+            now = time.time()
+            stalls.append(now - last[0] - 0.01)
+            last[0] = now
+        loop = task.LoopingCall(tick)
+        loop.start(0.01, now=False)
+        return loop, stalls
+
+    def run_sync():
+        loop, stalls = watch()
+        start = time.time()
+        latencies = []
+        for i in xrange(logins):
+            check_password(pwhash, 'secret')
+            latencies.append(time.time() - start)
+        # let the watcher see the stall
+        d = task.deferLater(reactor, 0.02, lambda: None)
+        def done(ignored):
+            loop.stop()
+            report('reactor', start, latencies, stalls)
+        d.addCallback(done)
+        return d
+
+    def run_async(ignored):
+        loop, stalls = watch()
+        start = time.time()
+        latencies = []
+        def checked(ok):
+            assert ok
+            latencies.append(time.time() - start)
+        ds = [check_password_async(pwhash, 'secret').addCallback(checked)
+                for i in xrange(logins)]
+        d = defer.gatherResults(ds)
+        def done(ignored):
+            loop.stop()
+            report('threads', start, latencies, stalls)
+        d.addCallback(done)
+        return d
+
+    def main():
+        d = run_sync()
+        d.addCallback(run_async)
+        d.addErrback(lambda f: f.printTraceback())
+        d.addBoth(lambda ignored: reactor.stop())
+
+    reactor.callWhenRunning(main)
+    reactor.run()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'bench':
+        if len(sys.argv) > 2:
+            bench(int(sys.argv[2]))
+        else:
+            bench()
+    else:
+        print 'usage: python src/passwords.py bench [<logins>]'
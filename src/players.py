@@ -23,8 +23,6 @@ Players subclass the Character class.
 '''
 
 
-import os
-import hashlib
 import time
 
 from twisted.internet import reactor
@@ -32,11 +30,15 @@ from twisted.internet import reactor
 from persistent.list import PersistentList
 
 from db import TZODB, TZIndex, TZDict
-dbroot = TZODB().root
+zodb = TZODB()
+dbroot = zodb.root
+commit = zodb.commit
+
+import passwords
 
 from colors import blue
 
-from share import Character, str_attr, class_as_string
+from share import Character, str_attr, class_as_string, hears
 
 import actions
 
@@ -88,7 +90,7 @@ def ls():
 def names():
     'Return a list of the names of all the players.'
 
-    k = dbroot['players'].keys()
+    k = list(dbroot['players'].keys())
     k.remove('_index')
     return k
 
@@ -96,6 +98,98 @@ def isplayer(obj):
     return obj in ls()
 
 
+def _actor_key(player, info):
+    actor = info['actor']
+    return (actor is player, player.can_see(actor))
+
+def _arrive_key(player, info):
+    arriver = info['actor']
+    x = info['fromx']
+    return (_actor_key(player, info),
+            x is not None and player.can_see(x),
+            player.following == arriver)
+
+# For these actions, the output of Player.near_<act> depends only on
+#   what the key function returns, so players with the same key (and
+#   the same client render settings) get exactly the same output.
+fanout_keys = dict(say=_actor_key,
+                    shout=_actor_key,
+                    emote=_actor_key,
+                    quit=_actor_key,
+                    arrive=_arrive_key)
+
+def inroom(room):
+    '''Return a list of the players in room.
+
+    The players are found through the client registry (TZ.roomclients)
+        without loading the room contents. If the registry does not
+        agree with the room (a player with no client, for instance)
+        the room contents are used instead.
+
+    '''
+
+    ids = room._player_ids
+    if getattr(tzprotocol.TZ, 'factory', None) is not None:
+        clients = tzprotocol.TZ.roomclients(room)
+        if len(clients) == len(ids):
+            plist = [client.player for client in clients]
+            for player in plist:
+                if player.tzid not in ids:
+                    break
+            else:
+                return plist
+    return room.players()
+
+def fanout(plist, info):
+    '''Pass the action in info on to each player in plist.
+
+    For the common actions listed in fanout_keys, the output is
+        rendered once for each group of players who would see the
+        same thing, and the same bytes are sent to everyone in the
+        group. Players whose class changes how they handle the
+        action are handled one at a time, as usual.
+
+    '''
+
+    act = info['act']
+    keyfunc = fanout_keys.get(act)
+    if keyfunc is None:
+        for player in plist:
+            player.act_near(info)
+        return
+
+    method_name = 'near_%s' % act
+    near = getattr(Player, method_name).im_func
+    act_near = Player.act_near.im_func
+
+    rendered = {}
+    for player in plist:
+        cls = player.__class__
+        client = tzprotocol.TZ.playerclient(player)
+        if (client is None or
+                cls.act_near.im_func is not act_near or
+                getattr(cls, method_name).im_func is not near):
+            player.act_near(info)
+            continue
+
+        key = (keyfunc(player, info), client.render_key())
+        data = rendered.get(key)
+        if data is None:
+            client.begin_capture()
+            try:
+                getattr(player, method_name)(info)
+            finally:
+                data = client.end_capture()
+            rendered[key] = data
+        elif data:
+            client.write(data)
+
+        # the rest of Player.act_near
+        for item in player.items():
+            if hears(item, act):
+                item.act_near(info)
+
+
 class Player(Character):
     'Base class for all players.'
 
@@ -146,30 +240,52 @@ class Player(Character):
     def set_password(self, pwtext):
         'Save the hashed password.'
 
-        hasher = hashlib.md5()
-        hasher.update(pwtext)
-        salt = hashlib.md5(os.urandom(4)).hexdigest()[:8]
-        hasher.update(salt)
-        pwhash = '{pw_v1}' + hasher.hexdigest() + salt
-
-        self.pwhash = pwhash
+        self.pwhash = passwords.hash_password(pwtext)
 
     def check_password(self, pwtext):
         'Return True if the hash of the given text matches the hashed password.'
 
-        if not self.pwhash.startswith('{pw_v1}'):
-            raise SystemError
+        return passwords.check_password(self.pwhash, pwtext)
 
-        hasher = hashlib.md5()
-        hasher.update(pwtext)
-        salt = self.pwhash[-8:]
-        hasher.update(salt)
-        pwhash = hasher.hexdigest()
+    def set_password_async(self, pwtext):
+        '''Hash the password in a thread, then save and commit it.
 
-        if pwhash == self.pwhash[7:-8]:
-            return True
-        else:
-            return False
+        Returns a Deferred which fires once the hash is saved.
+
+        '''
+
+        d = passwords.hash_password_async(pwtext)
+        d.addCallback(self._set_pwhash)
+        return d
+
+    def _set_pwhash(self, pwhash):
+        self.pwhash = pwhash
+        commit()
+
+    def check_password_async(self, pwtext):
+        '''Check the password in a thread.
+
+        Returns a Deferred which fires with True or False. If the
+            password is correct and the saved hash uses an old scheme,
+            it is replaced with a new hash (also in a thread).
+
+        '''
+
+        d = passwords.check_password_async(self.pwhash, pwtext)
+        d.addCallback(self._checked_password, pwtext)
+        return d
+
+    def _checked_password(self, ok, pwtext):
+        if ok and passwords.needs_upgrade(self.pwhash):
+            d = passwords.hash_password_async(pwtext)
+            d.addCallback(self._upgrade_pwhash, self.pwhash)
+        return ok
+
+    def _upgrade_pwhash(self, pwhash, oldhash):
+        if self.pwhash == oldhash:
+            # not changed by something else while hashing
+            print 'upgraded password hash for', self.name
+            self._set_pwhash(pwhash)
 
     def info(self):
         '''Return a multiline message (a list of strings) with detailed
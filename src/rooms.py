@@ -30,24 +30,27 @@ import copy
 import random
 
 from twisted.internet import reactor
+import transaction
 
 from persistent.list import PersistentList
 
-from db import TZODB, TZIndex
+from db import TZODB, TZIndex, TZNameIndex
 zodb = TZODB()
 dbroot = zodb.root
 commit = zodb.commit
 abort = zodb.abort
 
 import conf
+import timers
 import mobs
 import items
 import players
 from share import TZContainer, TZObj, class_as_string, int_attr, str_list_attr
-from share import register_plugin
+from share import register_plugin, hears
 from colors import green, yellow, red
 
 tzindex = TZIndex()
+nameindex = TZNameIndex('rooms')
 
 
 def get(rid):
@@ -59,10 +62,12 @@ def add(room):
     'Add the given room to the database.'
 
     dbroot['rooms'][room.tzid] = room
+    nameindex.add(room)
 
 def remove(room):
     'Remove the given room from the database.'
 
+    nameindex.remove(room)
     del dbroot['rooms'][room.tzid]
 
 def getname(name, all=False):
@@ -76,8 +81,9 @@ def getname(name, all=False):
     '''
 
     result = []
-    for room in ls():
-        if room.name == name or name in room.name_aka:
+    for rid in nameindex.find(name):
+        room = get(rid)
+        if room is not None:
             if not all:
                 return room
             else:
@@ -91,7 +97,7 @@ def getname(name, all=False):
 def ls():
     'Return a list of all the rooms in the database.'
 
-    return dbroot['rooms'].values()
+    return list(dbroot['rooms'].values())
 
 def names():
     '''Return a list of the names of all the rooms in the database.
@@ -123,14 +129,13 @@ class Room(TZContainer):
     name = 'proto room'
     name_aka = ['room']
     period = int_attr('period') # seconds
+    settings = ['period']
     _bse = 'Room'
 
     def __init__(self, name='', short='', long='', owner=None,
                     exits=None, items=None):
         TZContainer.__init__(self, name, short, long, owner, items)
 
-        self.settings.append('period')
-
         self._exit_ids = PersistentList()
         if exits is not None:
             for x in exits:
@@ -147,7 +152,8 @@ class Room(TZContainer):
     def destroy(self):
         '''Get rid of this room and remove it from the index.
 
-        All outgoing exits will also be destroyed.
+        All outgoing exits will also be destroyed. Exits in other rooms
+            which lead here are left without a destination.
         Any mob in the room will be teleported to its home. If this room
             is its home, the mob will be destroyed.
         Any player in the room will be teleported to its home.
@@ -158,6 +164,9 @@ class Room(TZContainer):
 
         for x in self.exits():
             x.destroy()
+        for x in exits.incoming(self):
+            if x is not None:
+                x.destination = None
         for mob in self.mobs():
             if mob.home is self:
                 mob.destroy()
@@ -165,6 +174,7 @@ class Room(TZContainer):
                 mob.teleport(mob.home)
         for player in self.players():
             player.teleport(player.home)
+        timers.cancel(self)
         remove(self)
         TZContainer.destroy(self)
 
@@ -194,20 +204,23 @@ class Room(TZContainer):
         if self.period:
             self.periodic()
             self._last_periodic = time.time()
-            reactor.callLater(self.period, self.periodically)
+            timers.later(self, 'periodically', self.period)
 
     def periodic(self):
         pass
 
     def nudge(self, delayfactor=10):
-        'Nudge this room to make sure the periodic calls are happening.'
+        '''Nudge this room to make sure the periodic calls are happening.
 
-        now = time.time()
+        The periodic calls use persistent timers, so a room only needs
+            a nudge if its timer has been lost.
 
-        if now > self._last_periodic + self.period * delayfactor:
+        '''
+
+        if not timers.pending(self, 'periodically'):
             self.periodically()
         else:
-            print 'Too recent to nudge.'
+            print 'Room already has a periodic timer.'
 
     def action(self, info):
         '''An action has occurred in this room which must be passed on to all
@@ -239,22 +252,10 @@ class Room(TZContainer):
             self.act_near(info)
 
             # Some actions can affect nearby rooms. If that is the case for
-            # this action, find the rooms from the exits and pass it on.
+            # this action, pass it on to the rooms within range.
             spread = info.get('spread', None)
             if spread is not None and spread > 0:
-                fromroom = info.get('fromroom', None)
-                info['fromroom'] = self
-                info['spread'] -= 1
-                for x in self.exits():
-                    room = x.destination
-                    if room == fromroom:
-                        continue
-                    for bx in room.exits():
-                        if bx.destination == self:
-                            info['fromx'] = bx
-                            break
-                    # EEE -- Could calling this here be a transaction problem?
-                    room.action(info)
+                self.propagate(info)
 
         except Exception, e:
             print 'room._action ABORT'
@@ -269,6 +270,68 @@ class Room(TZContainer):
             #print 'room._action COMMIT'
             commit()
 
+    def propagate(self, info):
+        '''Pass an action which spreads on to the nearby rooms.
+
+        Rooms are visited breadth first, up to info['spread'] exits away,
+            and each room hears the action only once, from the nearest
+            room. Each room gets its own copy of info, with spread
+            counted down and with fromroom set to the room it came from
+            and fromx to the exit which leads back there.
+
+        All of the rooms are handled in the current transaction. If one
+            room fails, only its own changes are rolled back.
+
+        A room whose class overrides action() (to filter what it hears)
+            gets the action through its action() method instead, and
+            spreads it on from there itself. The set of rooms already
+            reached goes along in info['visited'] so that no room
+            hears the action twice.
+
+        '''
+
+        visited = info.get('visited')
+        if visited is None:
+            visited = set()
+            info['visited'] = visited
+        visited.add(self.tzid)
+        frontier = [(self, info)]
+        while frontier:
+            reached = []
+            for room, rinfo in frontier:
+                spread = rinfo.get('spread', 0)
+                if spread <= 0:
+                    continue
+                for x in room.exits():
+                    destid = x._destid
+                    if destid is None or destid in visited:
+                        continue
+                    visited.add(destid)
+                    dest = x.destination
+                    if dest is None:
+                        continue
+
+                    hop = dict(rinfo)
+                    hop['spread'] = spread - 1
+                    hop['fromroom'] = room
+                    hop['fromx'] = exits.route(dest, room)
+
+                    if dest.__class__.action.im_func is not _plain_action:
+                        dest.action(hop)
+                        continue
+
+                    savepoint = transaction.savepoint(optimistic=True)
+                    try:
+                        dest.act_near(hop)
+                    except:
+                        print 'room.propagate ROLLBACK', dest
+                        savepoint.rollback()
+                        if conf.debug:
+                            import traceback
+                            traceback.print_exc()
+                    reached.append((dest, hop))
+            frontier = reached
+
     def act_near(self, info):
         '''Something has happened in this room. Handle it if necessary,
             and pass the action on to any contained items.
@@ -277,22 +340,40 @@ class Room(TZContainer):
 
         TZObj.act_near(self, info)
 
-        for player in self.players():
-            player.act_near(info)
+        players.fanout(players.inroom(self), info)
 
-        for mob in self.mobs():
-            mob.act_near(info)
+        for obj in self.listeners(info['act']):
+            obj.act_near(info)
 
-        for item in self.items():
-            item.act_near(info)
+    def listeners(self, act):
+        '''Return a list of the mobs, items and exits in this room which
+            want to know when act happens here (see share.hears).
 
-        for x in self.exits():
-            x.act_near(info)
+        The list for each action is cached (in memory only) until
+            something enters or leaves the room.
+
+        '''
+
+        key = (tzindex.generation, tuple(self._mob_ids),
+                tuple(self._item_ids), tuple(self._exit_ids))
+
+        cached = getattr(self, '_v_listeners', None)
+        if cached is None or cached[0] != key:
+            cached = (key, {})
+            self._v_listeners = cached
+
+        objs = cached[1].get(act)
+        if objs is None:
+            objs = [obj for obj in self.mobs() + self.items() + self.exits()
+                        if obj is not None and hears(obj, act)]
+            cached[1][act] = objs
+
+        return objs
 
     def players(self):
         'Return a list of all the players in this room'
 
-        return [tzindex.get(pid) for pid in self._player_ids]
+        return self.contents('_player_ids')
 
     def player(self, pid):
         '''Return the player in this room with the given id number, or None if
@@ -344,7 +425,7 @@ class Room(TZContainer):
     def mobs(self):
         'Return a list of the mobs in this room.'
 
-        return [tzindex.get(pid) for pid in self._mob_ids]
+        return self.contents('_mob_ids')
 
     def mob(self, mid):
         '''Return the mob with the given id number if it is in this room, or None
@@ -428,7 +509,7 @@ class Room(TZContainer):
     def exits(self):
         'Return a list of all the exits from this room.'
 
-        return [tzindex.get(xid) for xid in self._exit_ids]
+        return self.contents('_exit_ids')
 
     def exitnames(self):
         'Return a list of the names of all the exits from this room.'
@@ -681,7 +762,7 @@ class TimedTrap(Room):
     def near_arrive(self, info):
         if not self._springing:
             self._springing = time.time()
-            reactor.callLater(self.timer, self.spring_trap)
+            timers.later(self, 'spring_trap', self.timer)
 
     def spring_trap(self):
         self._springing = False
@@ -692,7 +773,7 @@ class TimedTrap(Room):
 class TeleTrap(TimedTrap):
     '''A trap that teleports characters to different rooms.
 
-    If _targets is empty, will select from all rooms randomly.
+    If targets is empty, will select from all rooms randomly.
 
     '''
 
@@ -704,8 +785,7 @@ class TeleTrap(TimedTrap):
         TimedTrap.__init__(self)
 
     def addtarget(self, name):
-        if name not in self._targets:
-            self._targets.append(name)
+        self.targets = name
 
     def near_teleport_character_in(self, info):
         self.near_arrive(info)
@@ -771,7 +851,7 @@ class Zoo(Room):
             if x.name.startswith('see the'):
                 outside = x.destination
                 for ox in outside.exits():
-                    if ox.destination != self:
+                    if ox._destid != self.tzid:
                         cage = ox.destination
                         # Try to remove any mobs that may have wandered
                         # in here before destroying any mobs.
@@ -1095,6 +1175,8 @@ class Exit(TZObj):
 
 import exits
 
+_plain_action = Room.action.im_func
+
 
 
 
@@ -54,29 +54,109 @@ class Deprecated(Exception):
     pass
 
 
+# settings which objects can be found by in the name indexes
+indexed_settings = ('name', 'name_aka')
+
+def _nameindex(obj):
+    '''Return the name index for the section of the database holding obj,
+        or None if obj is not (yet) in a section with a name index.
+
+    '''
+
+    tzid = getattr(obj, 'tzid', None)
+    if tzid is None:
+        return None
+
+    try:
+        mod = class_mod(obj)
+    except (AttributeError, KeyError):
+        return None
+
+    nameindex = getattr(mod, 'nameindex', None)
+    if nameindex is None or mod.get(tzid) is not obj:
+        return None
+
+    return nameindex
+
+def index_names(obj):
+    'Add the current names of obj to its name index.'
+
+    nameindex = _nameindex(obj)
+    if nameindex is not None:
+        nameindex.add(obj)
+
+def unindex_names(obj):
+    '''Remove the current names of obj from its name index.
+
+    Call this before changing the name of an object in some way
+        other than setting name or name_aka, then call index_names()
+        after the change.
+
+    '''
+
+    nameindex = _nameindex(obj)
+    if nameindex is not None:
+        nameindex.remove(obj)
+
+
+class setting_attr(property):
+    '''Property for a setting which keeps its value in the _vals dict
+        of the object.
+
+    A value is only kept if it differs from the default for the class
+        (see MetaTZObj), so most objects store very little. _vals is a
+        plain dict, pickled along with the object itself, so it must
+        only be changed through _setval.
+
+    '''
+
+    def __init__(self, name, default, getter, setter):
+        property.__init__(self, getter, setter)
+        self.name = name
+        self.default = default
+
+def _getval(obj, name, default):
+    vals = obj._vals
+    if vals is None:
+        # not yet upgraded to the compact settings
+        return getattr(obj, '_%s' % name, obj._setting_defaults.get(name, default))
+    try:
+        return vals[name]
+    except KeyError:
+        return obj._setting_defaults.get(name, default)
+
+def _setval(obj, name, val, default):
+    vals = obj._vals
+    if vals is None:
+        vals = {}
+        obj._vals = vals
+    if val == obj._setting_defaults.get(name, default):
+        vals.pop(name, None)
+    else:
+        vals[name] = val
+    obj._p_changed = True
+
 def int_attr(name, default=0):
     'An attribute that will always hold an integer'
 
-    varname = '_%s' % name
-    def getter(self, var=varname):
-        return getattr(self, var, default)
-    def setter(self, val, var=varname):
+    def getter(self):
+        return _getval(self, name, default)
+    def setter(self, val):
         val = int(val)
-        setattr(self, var, val)
-    return property(getter, setter)
+        _setval(self, name, val, default)
+    return setting_attr(name, default, getter, setter)
 
 def bool_attr(name, default=False):
     'An attribute that will always hold a boolean.'
 
-    varname = '_%s' % name
-    def getter(self, var=varname):
-        return getattr(self, var, default)
-    def setter(self, val, var=varname):
+    def getter(self):
+        return _getval(self, name, default)
+    def setter(self, val):
         if val not in (False, True):
             raise ValueError, 'Value must be a boolean.'
         val = bool(val)
-        setattr(self, var, val)
-    return property(getter, setter)
+        _setval(self, name, val, default)
+    return setting_attr(name, default, getter, setter)
 
 class SetOnceError(ValueError):
     pass
@@ -84,50 +164,52 @@ class SetOnceError(ValueError):
 def str_attr(name, default='', blank_ok=True, setonce=False):
     'An attribute that will always hold a string.'
 
-    varname = '_%s' % name
-    def getter(self, var=varname):
-        return getattr(self, var, default)
+    indexed = name in indexed_settings
+    def getter(self):
+        return _getval(self, name, default)
     if not setonce:
-        def setter(self, val, var=varname):
+        def setter(self, val):
             if val=='' and not blank_ok:
                 raise ValueError, 'Blank string not allowed.'
             val = unicode(val)
-            setattr(self, var, val)
+            if indexed:
+                unindex_names(self)
+            _setval(self, name, val, default)
+            if indexed:
+                index_names(self)
     else:
-        def setter(self, val, var=varname):
+        def setter(self, val):
             if val=='' and not blank_ok:
                 raise ValueError, 'Blank string not allowed.'
-            ival = getattr(self, varname, default)
+            ival = _getval(self, name, default)
             if not ival:
                 val = str(val)
-                setattr(self, var, val)
+                _setval(self, name, val, default)
             else:
                 raise SetOnceError, 'Cannot be changed once set.'
 
-    return property(getter, setter)
+    return setting_attr(name, default, getter, setter)
 
 def str_list_attr(name):
-    'An attribute that will always hold a list of strings.'
+    '''An attribute that will always hold a list of strings.
 
-    varname = '_%s' % name
-    def getter(self, var=varname):
-        val = getattr(self, var, None)
-        if val is not None:
-            return val
-        else:
-            sl = PersistentList()
-            setattr(self, var, sl)
-            return sl
-    def setter(self, val, var=varname):
-        sl = getattr(self, var, None)
-        if sl is None:
-            sl = PersistentList()
-            setattr(self, var, sl)
+    The value is a new list each time. To change it, set the attribute
+        to a list to replace the whole value, to a string to add that
+        string, or to '-DEL-' followed by a string to remove it.
+
+    '''
+
+    indexed = name in indexed_settings
+    def getter(self):
+        return list(_getval(self, name, ()))
+    def setter(self, val):
+        sl = list(_getval(self, name, ()))
+
+        if indexed:
+            unindex_names(self)
 
         if isinstance(val, list) or isinstance(val, PersistentList):
-            sl[:] = []
-            for v in val:
-                sl.append(v)
+            sl = list(val)
         elif not val.startswith('-DEL-'):
             if val not in sl:
                 sl.append(val)
@@ -136,9 +218,46 @@ def str_list_attr(name):
             if val in sl:
                 sl.remove(val)
 
+        _setval(self, name, tuple(sl), ())
+
+        if indexed:
+            index_names(self)
+
         commit()
 
-    return property(getter, setter)
+    return setting_attr(name, (), getter, setter)
+
+def compact_settings(obj):
+    '''Move the settings of obj from separate attributes in to _vals,
+        and drop its own copy of the settings list.
+
+    Used to upgrade the database from version 5 to version 6.
+
+    '''
+
+    obj._p_activate()
+    state = obj.__dict__
+    defaults = obj._setting_defaults
+
+    # keep anything already in _vals (an earlier upgrade step may have
+    #   rebuilt the object), and only fill in what is missing
+    vals = dict(state.get('_vals') or {})
+    for name in defaults:
+        for var in ('_%s' % name, name):
+            if var in state:
+                val = state.pop(var)
+                vals.setdefault(name, val)
+
+    for name, val in vals.items():
+        if isinstance(val, (list, PersistentList)):
+            val = tuple(val)
+            vals[name] = val
+        if name in defaults and val == defaults[name]:
+            del vals[name]
+
+    state.pop('settings', None)
+    obj._vals = vals
+    obj._p_changed = True
 
 
 def tzid():
@@ -203,13 +322,13 @@ class MetaTZObj(type):
         for stg in settings:
             makeprop = False
             currentattr = dict.get(stg, None)
-            if type(currentattr) is property:
+            if isinstance(currentattr, property):
                 makeprop = True
                 prop = currentattr
             else:
                 for base in bases:
                     baseattr = getattr(base, stg, None)
-                    if not makeprop and type(baseattr) is property:
+                    if not makeprop and isinstance(baseattr, property):
                         makeprop = True
                         prop = baseattr
 
@@ -226,7 +345,7 @@ class MetaTZObj(type):
                 pass
             elif type(currentattr) == type([]):
                 remember.setdefault(stg, []).extend(currentattr)
-            elif type(currentattr) is property:
+            elif isinstance(currentattr, property):
                 pass
             else:
                 remember[stg] = currentattr
@@ -236,9 +355,50 @@ class MetaTZObj(type):
 
         newcls = type.__new__(mcls, name, bases, dict)
         newcls._remember_settings = remember
+
+        # default values for the settings kept in _vals (see setting_attr)
+        #   either from the attribute itself, or remembered from a plain
+        #   value on this class or one of its bases.
+        defaults = {}
+        for attr in dir(newcls):
+            prop = getattr(newcls, attr, None)
+            if isinstance(prop, setting_attr):
+                default = remember.get(prop.name, prop.default)
+                if type(default) == type([]):
+                    default = tuple(_unique(default))
+                defaults[prop.name] = default
+        newcls._setting_defaults = defaults
+
+        # the actions this class has a near_<action> method for
+        newcls._near_acts = frozenset([attr[5:] for attr in dir(newcls)
+                                        if attr.startswith('near_')])
+
         return newcls
 
 
+def _unique(vals):
+    'Return a list of vals in the same order, leaving out repeats.'
+
+    result = []
+    for val in vals:
+        if val not in result:
+            result.append(val)
+    return result
+
+def hears(obj, act):
+    '''Return True if obj may do something when act happens near it.
+
+    Objects which change act_near (containers, for instance) are always
+        told about every action. Others only if they have a near_<act>
+        method.
+
+    '''
+
+    cls = obj.__class__
+    return (act in cls._near_acts or
+                cls.act_near.im_func is not _plain_act_near)
+
+
 class TZObj(Persistent):
     'Base class for all MUD objects.'
 
@@ -254,6 +414,10 @@ class TZObj(Persistent):
     wearable = False
     visible = bool_attr('visible', default=True)
 
+    # values of settings which differ from the class defaults
+    #   (see setting_attr). None until upgraded to database version 6.
+    _vals = None
+
     def _set_remembered_class_settings(self):
         '''settings remembered from superclasses during class construction
 
@@ -262,6 +426,9 @@ class TZObj(Persistent):
         '''
 
         for stg, val in self._remember_settings.items():
+            if stg in self._setting_defaults:
+                # used as the class default instead (see setting_attr)
+                continue
             if type(val) == type([]):
                 for v in val:
                     self.setting(stg, v)
@@ -269,9 +436,7 @@ class TZObj(Persistent):
                 self.setting(stg, val)
 
     def __init__(self, name='', short='', long='', owner=None, container=None):
-        settings = PersistentList()
-        settings += self.settings
-        self.settings = settings
+        self._vals = {}
 
         self._set_remembered_class_settings()
 
@@ -527,11 +692,10 @@ class TZObj(Persistent):
         '''
 
         act = info['act']
-        method_name = 'near_%s' % act
-        #print 'looking for %s on %s' % (method_name, self.name)
-        method = getattr(self, method_name, None)
-        if method is not None:
-            method(info)
+        if act in self._near_acts:
+            method_name = 'near_%s' % act
+            #print 'calling %s on %s' % (method_name, self.name)
+            getattr(self, method_name)(info)
 
     def look(self, looker):
         '''Return a multiline message (list of strings) for a player looking
@@ -588,6 +752,9 @@ class TZObj(Persistent):
             listener.message("You don't hear anything.")
 
 
+_plain_act_near = TZObj.act_near.im_func
+
+
 class TZContainer(TZObj):
     'Base class for all item-containing objects (including characters).'
 
@@ -637,13 +804,41 @@ class TZContainer(TZObj):
 
         TZObj.act_near(self, info)
 
+        act = info['act']
         for item in self.items():
-            item.act_near(info)
+            if hears(item, act):
+                item.act_near(info)
+
+    def contents(self, attr='_item_ids'):
+        '''Return a list of the objects with id numbers in the list
+            named attr (_item_ids, or for a room also _player_ids,
+            _mob_ids or _exit_ids).
+
+        The objects are looked up together with tzindex.get_many, and
+            the result is cached (in memory only) until the list of id
+            numbers or the index changes.
+
+        '''
+
+        ids = tuple(getattr(self, attr))
+        key = (tzindex.generation, ids)
+
+        views = getattr(self, '_v_contents', None)
+        if views is None:
+            views = {}
+            self._v_contents = views
+
+        view = views.get(attr)
+        if view is None or view[0] != key:
+            view = (key, tzindex.get_many(ids))
+            views[attr] = view
+
+        return list(view[1])
 
     def items(self):
         'Return a list of the items in this container.'
 
-        return [tzindex.get(iid) for iid in self._item_ids]
+        return self.contents('_item_ids')
 
     def item(self, iid):
         'Return the item with the give id number if it is in this container.'
@@ -794,10 +989,7 @@ Character (%s): %s
             room.action(dict(act='leave', actor=self, tox=x))
             self.move(dest)
 
-            backx = None
-            for backx in dest.exits():
-                if backx.destination == room:
-                    break
+            backx = exits.route(dest, room)
             dest.action(dict(act='arrive', actor=self, fromx=backx))
 
         return r
@@ -1349,6 +1541,9 @@ def upgrade(obj, newcls=None):
         elif attr.startswith('_p_'):
             pass
             #print '    ignoring'
+        elif attr in ('_remember_settings', '_setting_defaults', '_near_acts'):
+            # class information from MetaTZObj
+            pass
         elif attr == 'tzid':
             print '        tzid'
         elif attr == 'name':
@@ -1406,7 +1601,7 @@ def upgrade(obj, newcls=None):
     try:
         updated.name = obj.name
     except SetOnceError:
-        updated._name = obj.name
+        _setval(updated, 'name', obj.name, '')
 
     if addtomodindex:
         module.add(updated)
@@ -1439,19 +1634,70 @@ def upgradeall():
     commit()
 
 
+_cmd_tries = {}
+
+def cmd_trie(section):
+    '''Return the prefix trie of the command names in section.
+
+    Each node is a pair (children, names) where children maps the next
+        letter to another node, and names is the sorted list of all of
+        the command names beginning with the prefix leading to that node.
+
+    The trie is built the first time it is needed, and kept until
+        invalidate_cmds is called.
+
+    '''
+
+    trie = _cmd_tries.get(section)
+    if trie is None:
+        cmds = [c[4:] for c in dir(section) if c.startswith('cmd_')]
+        cmds.sort()
+        trie = ({}, [])
+        for c in cmds:
+            node = trie
+            node[1].append(c)
+            for letter in c:
+                node = node[0].setdefault(letter, ({}, []))
+                node[1].append(c)
+        _cmd_tries[section] = trie
+    return trie
+
+def invalidate_cmds(section=None):
+    '''Throw away the cached command trie for section, or for all
+        sections if section is not given.
+
+    Must be called whenever the commands in a section may have changed,
+        for instance after the module is rebuilt.
+
+    '''
+
+    if section is None:
+        _cmd_tries.clear()
+    else:
+        _cmd_tries.pop(section, None)
+
 def nearest_cmd(section, cmd, all=False):
-    cmds = [c[4:] for c in dir(section) if c.startswith('cmd_')]
-    cmds = [c for c in cmds if c.startswith(cmd)]
+    '''Return the first command (alphabetically) in section which
+        begins with cmd, or an empty list if there is none.
+
+    If all is True, return a list of the names of all such commands.
+
+    '''
+
+    node = cmd_trie(section)
+    for letter in cmd:
+        node = node[0].get(letter)
+        if node is None:
+            cmds = []
+            break
+    else:
+        cmds = node[1]
 
     if cmds and not all:
-        cmds.append(cmd)
-        cmds.sort()
-        c = cmds.index(cmd)
-        closest = cmds[c+1]
-        return getattr(section, 'cmd_%s' % closest)
+        return getattr(section, 'cmd_%s' % cmds[0])
 
     else:
-        return cmds
+        return list(cmds)
 
 
 # Delay these imports due to circular dependencies
@@ -0,0 +1,180 @@
+# Copyright 2008 Lee Harr
+#
+# This file is part of TZMud.
+#
+# TZMud is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# TZMud is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with TZMud.  If not, see <http://www.gnu.org/licenses/>.
+
+
+'''Telnet option negotiation.
+
+Handles the telnet IAC sequences sent by clients, and supports two
+    options:
+
+    NAWS (RFC 1073) -- the client reports its window size, which is
+        used as the line width if the player has not set one.
+
+    MCCP2 -- everything sent to the client after negotiation is
+        compressed with zlib, using one compressor for the whole
+        connection.
+
+Any other option the client asks for is refused.
+
+'''
+
+import zlib
+
+import conf
+
+
+IAC = chr(255)
+DONT = chr(254)
+DO = chr(253)
+WONT = chr(252)
+WILL = chr(251)
+SB = chr(250)
+SE = chr(240)
+
+NAWS = chr(31)
+MCCP2 = chr(86)
+
+
+class TelnetMixin(object):
+    '''Mix in before basic.LineReceiver to handle telnet negotiation.
+
+    The protocol must send all of its output through send().
+
+    Set telnet = False (on the class or the instance) to turn this off
+        for connections which are not telnet.
+
+    '''
+
+    telnet = True
+
+    def telnet_init(self):
+        'Start negotiation with a newly connected client.'
+
+        self._telnet_buf = ''
+        self._compressor = None
+        self.naws_width = None
+        self.naws_height = None
+
+        if not self.telnet:
+            return
+
+        if conf.telnet_naws:
+            self.transport.write(IAC + DO + NAWS)
+        if conf.telnet_mccp:
+            self.transport.write(IAC + WILL + MCCP2)
+
+    def dataReceived(self, data):
+        'Remove any telnet commands, then pass the rest on as usual.'
+
+        if self.telnet:
+            data = self.telnet_filter(data)
+        if data:
+            super(TelnetMixin, self).dataReceived(data)
+
+    def telnet_filter(self, data):
+        '''Handle the telnet commands in data, and return the plain text.
+
+        A command split across two packets is kept until the rest of
+            it arrives.
+
+        '''
+
+        data = self._telnet_buf + data
+        self._telnet_buf = ''
+
+        text = []
+        i = 0
+        n = len(data)
+        while i < n:
+            j = data.find(IAC, i)
+            if j < 0:
+                text.append(data[i:])
+                break
+            text.append(data[i:j])
+
+            if j+1 >= n:
+                self._telnet_buf = data[j:]
+                break
+
+            cmd = data[j+1]
+            if cmd == IAC:
+                text.append(IAC)
+                i = j + 2
+            elif cmd in (DO, DONT, WILL, WONT):
+                if j+2 >= n:
+                    self._telnet_buf = data[j:]
+                    break
+                self.telnet_option(cmd, data[j+2])
+                i = j + 3
+            elif cmd == SB:
+                end = data.find(IAC + SE, j+2)
+                if end < 0:
+                    self._telnet_buf = data[j:]
+                    break
+                sub = data[j+2:end].replace(IAC+IAC, IAC)
+                self.telnet_subnegotiation(sub)
+                i = end + 2
+            else:
+                # NOP, GA, AYT, etc. Ignored.
+                i = j + 2
+
+        return ''.join(text)
+
+    def telnet_option(self, cmd, option):
+        'Respond to DO, DONT, WILL or WONT for option.'
+
+        if cmd == DO and option == MCCP2 and conf.telnet_mccp:
+            self.start_compression()
+        elif cmd == DONT and option == MCCP2:
+            self.end_compression()
+        elif cmd == WILL and option == NAWS and conf.telnet_naws:
+            pass # window size will follow in a subnegotiation
+        elif cmd == WILL:
+            self.transport.write(IAC + DONT + option)
+        elif cmd == DO:
+            self.transport.write(IAC + WONT + option)
+
+    def telnet_subnegotiation(self, sub):
+        'Handle the body of an IAC SB ... IAC SE sequence.'
+
+        if sub[:1] == NAWS and len(sub) == 5:
+            self.naws_width = ord(sub[1])*256 + ord(sub[2])
+            self.naws_height = ord(sub[3])*256 + ord(sub[4])
+
+    def start_compression(self):
+        'Tell the client that compression starts now, and start it.'
+
+        if self._compressor is None:
+            self.flush()
+            self.transport.write(IAC + SB + MCCP2 + IAC + SE)
+            self._compressor = zlib.compressobj(conf.telnet_mccp_level)
+
+    def end_compression(self):
+        'Finish the compressed stream, and send plain text after this.'
+
+        if self._compressor is not None:
+            self.flush()
+            self.transport.write(self._compressor.flush(zlib.Z_FINISH))
+            self._compressor = None
+
+    def send(self, data):
+        'Send data to the client, compressed if MCCP2 is on.'
+
+        if self._compressor is not None:
+            data = (self._compressor.compress(data) +
+                    self._compressor.flush(zlib.Z_SYNC_FLUSH))
+        self.transport.write(data)
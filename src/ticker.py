@@ -0,0 +1,201 @@
+# Copyright 2008 Lee Harr
+#
+# This file is part of TZMud.
+#
+# TZMud is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# TZMud is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with TZMud.  If not, see <http://www.gnu.org/licenses/>.
+
+
+'''World tick scheduler.
+
+Objects which need to act regularly (mobs) are kept in the buckets
+    of a time wheel, by the tick on which they are next due, instead
+    of each one having its own reactor.callLater.
+
+Every conf.tick_interval seconds the ticker collects the objects
+    which are due, and calls act() on as many of them as it can in
+    conf.tick_budget seconds, all inside one transaction. Anything
+    left over waits for the next tick, so that a large number of
+    mobs cannot starve player input.
+
+'''
+
+import time
+import math
+from collections import deque
+
+from twisted.internet import reactor
+
+import conf
+
+from db import TZODB, TZIndex
+zodb = TZODB()
+commit = zodb.commit
+abort = zodb.abort
+
+tzindex = TZIndex()
+
+
+class Ticker(object):
+    'Time wheel scheduler. A Borg object with state which all share.'
+
+    _state = {}
+    def __new__(cls, *p, **k):
+        self = object.__new__(cls)
+        self.__dict__ = cls._state
+        return self
+
+    def __init__(self):
+        if not hasattr(self, 'wheel'):
+            self.interval = conf.tick_interval
+            self.wheel = [[] for i in range(conf.tick_slots)]
+            self.due = {}
+            self.ready = deque()
+            self.tick = 0
+            self.started = None
+            self.stats = dict(acts=0, errors=0, deferred=0)
+
+    def start(self):
+        'Start the ticker, if it is not already running.'
+
+        if self.started is None:
+            self.started = time.time()
+            reactor.callLater(self.interval, self.run)
+
+    def now(self):
+        'Return the number of the tick which should be running now.'
+
+        return int((time.time() - self.started) / self.interval)
+
+    def schedule(self, obj, delay):
+        '''Arrange for obj.act() to be called in delay seconds.
+
+        If obj is already scheduled to act sooner, nothing is changed,
+            so calling schedule more than once is harmless.
+
+        '''
+
+        self.start()
+
+        ticks = max(1, int(math.ceil(delay / self.interval)))
+        due = self.tick + ticks
+        tzid = obj.tzid
+        if tzid in self.due and self.due[tzid] <= due:
+            return
+
+        self.due[tzid] = due
+        self.wheel[due % len(self.wheel)].append((due, tzid))
+
+    def unschedule(self, obj):
+        'obj will not act again until it is scheduled again.'
+
+        self.due.pop(obj.tzid, None)
+
+    def scheduled(self, obj):
+        'Return True if obj is waiting to act.'
+
+        return obj.tzid in self.due
+
+    def collect(self, tick):
+        'Move the objects due on the given tick to the ready queue.'
+
+        slot = self.wheel[tick % len(self.wheel)]
+        waiting = []
+        for due, tzid in slot:
+            if self.due.get(tzid) != due:
+                # rescheduled or unscheduled since
+                continue
+            elif due <= tick:
+                del self.due[tzid]
+                self.ready.append(tzid)
+            else:
+                # due on a later turn of the wheel
+                waiting.append((due, tzid))
+        slot[:] = waiting
+
+    def run(self):
+        'Run one tick, then check again later.'
+
+        try:
+            zodb.hold()
+            try:
+                acted = self.run_tick()
+            finally:
+                zodb.release()
+            if acted:
+                commit()
+        except:
+            self.stats['errors'] += 1
+            print 'ticker ABORT'
+            abort()
+            if conf.debug:
+                import traceback
+                traceback.print_exc()
+        finally:
+            reactor.callLater(self.interval, self.run)
+
+    def run_tick(self):
+        '''Act on the objects which are due. Returns the number of
+            objects which acted.
+
+        The database is held while this runs (see TZODB.hold), so if an
+            object commits, it does not split the batch, and run()
+            commits all of the changes together.
+
+        '''
+
+        now = self.now()
+        while self.tick < now:
+            self.tick += 1
+            self.collect(self.tick)
+
+        end = time.time() + conf.tick_budget
+        acted = 0
+        while self.ready and (not acted or time.time() < end):
+            tzid = self.ready.popleft()
+            obj = tzindex.get(tzid)
+            if obj is None or not obj.exists():
+                continue
+            self.act(obj)
+            acted += 1
+
+        self.stats['acts'] += acted
+        self.stats['deferred'] += len(self.ready)
+
+        return acted
+
+    def act(self, obj):
+        '''Call obj.act(), then schedule it to act again.
+
+        If act() fails, only the changes made by that object are
+            rolled back.
+
+        '''
+
+        savepoint = zodb.savepoint()
+        try:
+            obj.act()
+        except:
+            self.stats['errors'] += 1
+            zodb.rollback(savepoint)
+            if conf.debug:
+                import traceback
+                traceback.print_exc()
+
+        self.schedule(obj, obj.period)
+
+
+ticker = Ticker()
+schedule = ticker.schedule
+unschedule = ticker.unschedule
+scheduled = ticker.scheduled
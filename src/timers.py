@@ -0,0 +1,204 @@
+# Copyright 2008 Lee Harr
+#
+# This file is part of TZMud.
+#
+# TZMud is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# TZMud is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with TZMud.  If not, see <http://www.gnu.org/licenses/>.
+
+
+'''Persistent timers for MUD objects.
+
+A timer calls a method of a MUD object at a given time. Timers are
+    kept in the database (in dbroot['_timers']) so they survive a
+    server restart.
+
+Every conf.timer_interval seconds all of the timers which are due
+    are fired together in one transaction.
+
+'''
+
+import sys
+import time
+
+from twisted.internet import reactor
+import transaction
+from BTrees.OOBTree import OOTreeSet
+
+import conf
+
+from db import TZODB, TZIndex, TZDict, TZIOBTree, TZOOBTree
+zodb = TZODB()
+dbroot = zodb.root
+commit = zodb.commit
+abort = zodb.abort
+
+tzindex = TZIndex()
+
+
+def init():
+    '''Create the timer section of the database if needed.
+
+    Returns True if the section is new, meaning that any timers which
+        were running before the upgrade need to be started again.
+
+    '''
+
+    if '_timers' in dbroot:
+        return False
+
+    timers = TZDict()
+    timers['next'] = 0
+    timers['due'] = TZOOBTree()
+    timers['byobj'] = TZIOBTree()
+    dbroot['_timers'] = timers
+    commit()
+    return True
+
+def _timers():
+    if '_timers' not in dbroot:
+        init()
+    return dbroot['_timers']
+
+def schedule(obj, method, at, *args):
+    '''Call obj.method(*args) at time at (as returned by time.time()).
+
+    Returns the key of the new timer.
+
+    '''
+
+    timers = _timers()
+    tid = timers['next']
+    timers['next'] = tid + 1
+
+    key = (at, tid)
+    timers['due'][key] = (obj.tzid, method, args)
+
+    byobj = timers['byobj']
+    keys = byobj.get(obj.tzid)
+    if keys is None:
+        keys = OOTreeSet()
+        byobj[obj.tzid] = keys
+    keys.insert(key)
+
+    return key
+
+def later(obj, method, delay, *args):
+    'Call obj.method(*args) in delay seconds.'
+
+    return schedule(obj, method, time.time()+delay, *args)
+
+def _remove(key):
+    timers = _timers()
+    tzid, method, args = timers['due'][key]
+    del timers['due'][key]
+
+    byobj = timers['byobj']
+    keys = byobj.get(tzid)
+    if keys is not None:
+        if key in keys:
+            keys.remove(key)
+        if not len(keys):
+            del byobj[tzid]
+
+def cancel(obj, method=None):
+    '''Cancel the timers for obj.
+
+    If method is given, cancel only the timers calling that method.
+
+    '''
+
+    for at, key, m, args in _pending(obj):
+        if method is None or m == method:
+            _remove(key)
+
+def _pending(obj):
+    timers = _timers()
+    due = timers['due']
+    keys = timers['byobj'].get(obj.tzid, ())
+    result = []
+    for key in keys:
+        tzid, method, args = due[key]
+        result.append((key[0], key, method, args))
+    return result
+
+def pending(obj=None, method=None):
+    '''Return a list of (time, obj, method, args) for waiting timers.
+
+    If obj is given, list only the timers for that object, and if
+        method is also given, only the timers calling that method.
+
+    '''
+
+    if obj is not None:
+        return [(at, obj, m, args) for at, key, m, args in _pending(obj)
+                    if method is None or m == method]
+
+    result = []
+    for key, (tzid, m, args) in _timers()['due'].items():
+        result.append((key[0], tzindex.get(tzid), m, args))
+    return result
+
+def start():
+    'Start checking for due timers.'
+
+    init()
+    reactor.callLater(conf.timer_interval, run)
+
+def run():
+    'Fire all of the timers which are due, then check again later.'
+
+    try:
+        fire(time.time())
+    finally:
+        reactor.callLater(conf.timer_interval, run)
+
+def fire(now):
+    '''Fire all of the timers which were due at or before now.
+
+    Each timer runs under its own savepoint, so an error only rolls
+        back the changes made by that timer. All of the changes are
+        committed together at the end.
+
+    '''
+
+    due = _timers()['due']
+    keys = list(due.keys(None, (now, sys.maxint)))
+    if not keys:
+        return
+
+    for key in keys:
+        if key not in due:
+            # cancelled by an earlier timer
+            continue
+        tzid, method, args = due[key]
+        _remove(key)
+
+        obj = tzindex.get(tzid)
+        if obj is None:
+            continue
+
+        savepoint = transaction.savepoint(optimistic=True)
+        try:
+            getattr(obj, method)(*args)
+        except:
+            print 'timer ABORT', obj, method
+            try:
+                savepoint.rollback()
+            except:
+                # savepoint no longer valid (something committed)
+                abort()
+            if conf.debug:
+                import traceback
+                traceback.print_exc()
+
+    commit()
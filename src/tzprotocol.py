@@ -25,6 +25,8 @@ wrapper.subsequent_indent = '    '
 wrap = wrapper.wrap
 
 import re
+ansi_re = re.compile('\x1b.*?m')
+
 class Wrapper(TextWrapper):
     def _wrap_chunks(self, chunks):
         lines = []
@@ -61,7 +63,7 @@ class Wrapper(TextWrapper):
         if not '\x1b' in chunk:
             return len(chunk)
         else:
-            return len(re.sub('\x1b.*?m', '', chunk))
+            return len(ansi_re.sub('', chunk))
 
 ansiwrapper = Wrapper()
 ansiwrapper.width = 79
@@ -70,14 +72,101 @@ ansiwrapper.subsequent_indent = '    '
 ansiwrap = ansiwrapper.wrap
 
 
+import os
 import hashlib
 import time
+from collections import deque
 
 from twisted.protocols import basic
 from twisted.internet import reactor
 
 import conf
 
+from cache import LRUCache
+render_cache = LRUCache(conf.render_cache_size)
+
+_wrappers = {(True, ansiwrapper.width): ansiwrapper,
+                (False, wrapper.width): wrapper}
+
+def get_wrapper(color, width):
+    'Return a text wrapper for the given width, which handles colors if needed.'
+
+    w = _wrappers.get((color, width))
+    if w is None:
+        if color:
+            w = Wrapper()
+        else:
+            w = TextWrapper()
+        w.width = width
+        w.replace_whitespace = False
+        w.subsequent_indent = '    '
+        _wrappers[(color, width)] = w
+    return w
+
+def render(msg, color, indent=0, width=None):
+    '''Return msg formatted (with or without color), wrapped, indented
+        and encoded, ready to send to a client.
+
+    If width is not given, uses the default width (79 with color,
+        70 without).
+
+    Results are cached, since the same text (room descriptions, help,
+        broadcasts) is often sent to many clients.
+
+    '''
+
+    if width is None:
+        if color:
+            width = ansiwrapper.width
+        else:
+            width = wrapper.width
+    key = (msg, color, width, indent)
+
+    data = render_cache.get(key)
+    if data is None:
+        if color:
+            msg = msg % colors.yes
+        else:
+            msg = msg % colors.no
+        wrapped = get_wrapper(color, width).wrap(msg)
+
+        if wrapped:
+            lines = [' '*indent + line.encode('utf-8') + '\r\n'
+                        for line in wrapped]
+            data = ''.join(lines)
+        else:
+            data = '\r\n'
+        render_cache[key] = data
+
+    return data
+
+_motd = dict(fname=None, mtime=None, data='')
+
+def motd(fname='MOTD'):
+    '''Return the message of the day, encoded and ready to send.
+
+    The file is only read again if it has been changed.
+
+    '''
+
+    try:
+        mtime = os.stat(fname).st_mtime
+    except OSError:
+        return ''
+
+    if _motd['fname'] != fname or _motd['mtime'] != mtime:
+        lines = []
+        with open(fname) as f:
+            for line in f:
+                try:
+                    line = unicode(line.rstrip()).encode('utf-8')
+                except UnicodeDecodeError:
+                    line = '??UDE??'
+                lines.append(line + '\r\n')
+        _motd.update(fname=fname, mtime=mtime, data=''.join(lines))
+
+    return _motd['data']
+
 from db import TZODB, TZIndex
 commit = TZODB().commit
 abort = TZODB().abort
@@ -92,39 +181,167 @@ import admin
 
 import players
 import rooms
+import passwords
+
+from telnet import TelnetMixin
 
 import parse
 import share
 
 
 
-class TZ(basic.LineReceiver):
+# basic.LineReceiver is an old-style class. TZ must be new-style (the
+#   object base) or the room property would be ignored on assignment.
+class TZ(TelnetMixin, basic.LineReceiver, object):
     'Twisted protocol. One is created for each client connection.'
 
     delimiter = '\n'
+    MAX_LENGTH = conf.input_max_line
 
     def __init__(self):
         zodb = TZODB()
         self.dbroot = zodb.root
         self.login_failures = 0
 
+        self._outbuf = []
+        self._outlen = 0
+        self._flush_call = None
+        self._capture = None
+        self.paused = False
+
+        self._room = None
+        self._pager = None
+
+        self._inqueue = deque()
+        self._input_call = None
+        self._tokens = conf.input_burst
+        self._tokens_time = time.time()
+        self._skip_line = False
+        self._leftover = ''
+        self._flooded = False
+        self._waiting = False
+
     def connectionMade(self):
         'A new connection. Send out the MOTD.'
 
         print "Got new client!"
+        self.telnet_init()
         self.logged_in = False
         self.room = None
-        self.factory.clients.append(self)
+        self.factory.clients.add(self)
+        self.transport.registerProducer(self, True)
 
         self.motd()
 
+    def _get_room(self):
+        return self._room
+
+    def _set_room(self, room):
+        'Keep the room -> clients registry up to date.'
+
+        roomclients = self.factory._room_clients
+        old = self._room
+        if old is not None:
+            clients = roomclients.get(old.tzid)
+            if clients is not None:
+                clients.discard(self)
+                if not clients:
+                    del roomclients[old.tzid]
+
+        self._room = room
+        if room is not None:
+            roomclients.setdefault(room.tzid, set()).add(self)
+
+    room = property(_get_room, _set_room)
+
+    def write(self, data):
+        '''Add data to the output buffer.
+
+        Everything written during one reactor turn (one command, or one
+            action being delivered) is sent together at the end of the
+            turn by flush(), unless the buffer grows beyond
+            conf.output_high_water bytes, in which case it is sent
+            right away.
+
+        '''
+
+        if self._capture is not None:
+            self._capture.append(data)
+
+        self._outbuf.append(data)
+        self._outlen += len(data)
+
+        if self.paused:
+            if self._outlen > conf.output_max_buffer:
+                print 'Output buffer overflow. Dropping slow client.'
+                self._outbuf = []
+                self._outlen = 0
+                self.transport.loseConnection()
+        elif self._outlen > conf.output_high_water:
+            self.flush()
+        elif self._flush_call is None:
+            self._flush_call = reactor.callLater(0, self.flush)
+
+    def flush(self):
+        'Send everything in the output buffer to the client.'
+
+        if self._flush_call is not None:
+            if self._flush_call.active():
+                self._flush_call.cancel()
+            self._flush_call = None
+
+        if self._outbuf and not self.paused:
+            data = ''.join(self._outbuf)
+            self._outbuf = []
+            self._outlen = 0
+            self.send(data)
+
+    def begin_capture(self):
+        'Start keeping a copy of everything written to this client.'
+
+        self._capture = []
+
+    def end_capture(self):
+        'Stop capturing, and return everything written since begin_capture.'
+
+        data = ''.join(self._capture)
+        self._capture = None
+        return data
+
+    def disconnect(self):
+        'Send any waiting output, then close the connection.'
+
+        self.paused = False
+        self.flush()
+        self.end_compression()
+        self.transport.loseConnection()
+
+    # Producer interface. The transport pauses the protocol when the
+    #   client is not reading its output fast enough. While paused, no
+    #   more input is read from the client and output is held in the
+    #   buffer (up to conf.output_max_buffer bytes).
+
+    def pauseProducing(self):
+        self.paused = True
+        self.transport.pauseProducing()
+
+    def resumeProducing(self):
+        self.paused = False
+        # handle any lines which arrived while paused (the buffer is
+        #   already past the telnet filter, so skip TelnetMixin)
+        basic.LineReceiver.dataReceived(self, '')
+        self._receive_leftover()
+        self.transport.resumeProducing()
+        self.flush()
+
+    def stopProducing(self):
+        self._outbuf = []
+        self._outlen = 0
+
     def motd(self):
         'Message of the day.'
 
-        lines = open('MOTD').readlines()
-
-        for line in lines:
-            self.simessage(line.rstrip())
+        self.write(motd())
 
     def login(self, r):
         'Log a player in if possible.'
@@ -139,32 +356,42 @@ class TZ(basic.LineReceiver):
                 self.simessage('Incorrect user name or password.')
                 self.login_failures += 1
                 print 'player', player_name, 'does not exist'
-            elif player.logged_in:
-                if player.check_password(pwtext):
-                    self.simessage('Player already logged in.')
-                    self.simessage('Use "purge <name> <password>" to disconnect other session.')
-                    print 'player', player.name, 'already logged in'
+                self._check_failures()
             else:
-                if player.check_password(pwtext):
-                #if True:
-                    self.logged_in = True
-                    player.logged_in = True
-                    self.player = player
-                    player.last = time.time()
-                    player.following = None
-                    self.factory._player_protocols[player_name] = self
-
-                    wizard.cmd_teleport(self, {})
-                    reactor.callLater(0.6, actions.cmd_look, self,
-                                        dict(verb='look'))
-                    print 'player', player.name, 'logged in'
-                else:
-                    self.simessage('Incorrect user name or password.')
-                    print 'player', player.name, 'wrong password'
-                    self.login_failures += 1
+                d = player.check_password_async(pwtext)
+                self.wait_for(d, self._login_checked, player)
 
-            if self.login_failures >= 3:
-                self.transport.loseConnection()
+    def _login_checked(self, ok, player):
+        'Finish logging in, once the password has been checked.'
+
+        if not ok:
+            self.simessage('Incorrect user name or password.')
+            print 'player', player.name, 'wrong password'
+            self.login_failures += 1
+            self._check_failures()
+
+        elif player.logged_in or self.logged_in:
+            self.simessage('Player already logged in.')
+            self.simessage('Use "purge <name> <password>" to disconnect other session.')
+            print 'player', player.name, 'already logged in'
+
+        else:
+            self.logged_in = True
+            player.logged_in = True
+            self.player = player
+            player.last = time.time()
+            player.following = None
+            self.factory._player_protocols[player.tzid] = self
+            self.factory._logged_in.add(self)
+
+            wizard.cmd_teleport(self, {})
+            reactor.callLater(0.6, actions.cmd_look, self,
+                                dict(verb='look'))
+            print 'player', player.name, 'logged in'
+
+    def _check_failures(self):
+        if self.login_failures >= 3:
+            self.disconnect()
 
     def create(self, r):
         'Create a new account.'
@@ -180,13 +407,23 @@ class TZ(basic.LineReceiver):
             elif player_name=='quit':
                 self.simessage('Cannot use the name "quit"')
             else:
-                player = players.Player(player_name)
-                player.set_password(pwtext)
-                if len(players.ls()) == 1:
-                    admin.add(player)
+                d = passwords.hash_password_async(pwtext)
+                self.wait_for(d, self._create_hashed, player_name)
+
+    def _create_hashed(self, pwhash, player_name):
+        'Create the account, once the password has been hashed.'
+
+        if players.getname(player_name):
+            self.simessage('Name already in use.')
+            return
+
+        player = players.Player(player_name)
+        player.pwhash = pwhash
+        if len(players.ls()) == 1:
+            admin.add(player)
 
-                self.simessage('Account created.')
-                self.simessage('Log in with "login <name> <password>"')
+        self.simessage('Account created.')
+        self.simessage('Log in with "login <name> <password>"')
 
     def purge(self, r):
         'Disconnect other session with this account logged in.'
@@ -197,21 +434,79 @@ class TZ(basic.LineReceiver):
             self.simessage('Incorrect user name or password.')
         else:
             player = players.getname(player_name)
-            if player.check_password(pwtext):
-                if player.logged_in:
-                    self._purge(player)
-                    self.simessage('Connection purged.')
-                    self.simessage('Log in with "login <name> <password>"')
-                else:
-                    self.simessage('Player is not logged in.')
-            else:
+            if player is None:
                 self.simessage('Incorrect user name or password.')
+            else:
+                d = player.check_password_async(pwtext)
+                self.wait_for(d, self._purge_checked, player)
+
+    def _purge_checked(self, ok, player):
+        'Purge the other session, once the password has been checked.'
+
+        if not ok:
+            self.simessage('Incorrect user name or password.')
+        elif player.logged_in:
+            self._purge(player)
+            self.simessage('Connection purged.')
+            self.simessage('Log in with "login <name> <password>"')
+        else:
+            self.simessage('Player is not logged in.')
+
+    def wait_for(self, d, callback, *args):
+        '''Run no more input from this client until the Deferred d
+            has fired, then call callback(result, *args).
+
+        The callback runs in its own transaction, which is committed
+            only if it runs without errors. It is not called if the
+            client has disconnected in the mean time.
+
+        '''
+
+        self._waiting = True
+        d.addCallback(self._run_callback, callback, args)
+        d.addErrback(self._wait_failed)
+        d.addBoth(self._done_waiting)
+        return d
+
+    def _run_callback(self, result, callback, args):
+        if self not in self.factory.clients:
+            return
+
+        try:
+            callback(result, *args)
+        except Exception, e:
+            abort()
+            print 'wait_for ABORTING TRANSACTION'
+            if conf.debug:
+                import traceback
+                print traceback.format_exc()
+        else:
+            commit()
+
+    def _wait_failed(self, failure):
+        print 'wait_for FAILED'
+        if conf.debug:
+            failure.printTraceback()
+
+    def _done_waiting(self, result):
+        self._waiting = False
+        if self in self.factory.clients:
+            self.run_queue()
 
     def connectionLost(self, reason):
         'Client has disconnected.'
 
         print "Lost a client!"
-        self.factory.clients.remove(self)
+        self.factory.clients.discard(self)
+        self.factory._logged_in.discard(self)
+        self.transport.unregisterProducer()
+        if self._flush_call is not None and self._flush_call.active():
+            self._flush_call.cancel()
+        self._flush_call = None
+        if self._input_call is not None and self._input_call.active():
+            self._input_call.cancel()
+        self._input_call = None
+        self._inqueue.clear()
 
         try:
             room = self.room
@@ -227,12 +522,102 @@ class TZ(basic.LineReceiver):
             #print 'TZ.connectionLost COMMIT'
             commit()
 
+        self.room = None
         if hasattr(self, 'player'):
-            del self.factory._player_protocols[self.player.name]
+            tzid = self.player.tzid
+            if self.factory._player_protocols.get(tzid) is self:
+                del self.factory._player_protocols[tzid]
+
+    def dataReceived(self, data):
+        '''Handle data from the client, then any data left over after
+            a line which was too long (see lineLengthExceeded).
+
+        '''
+
+        super(TZ, self).dataReceived(data)
+        self._receive_leftover()
+
+    def _receive_leftover(self):
+        while self._leftover:
+            rest = self._leftover
+            self._leftover = ''
+            basic.LineReceiver.dataReceived(self, rest)
 
     def lineReceived(self, line):
         '''Called each time a new line of input is received from the client.
 
+        The line is added to the input queue. Commands are taken from
+            the queue at up to conf.input_rate per second (with bursts
+            of up to conf.input_burst). If more than conf.input_queue_max
+            lines are waiting, the extra lines are dropped.
+
+        '''
+
+        if self._skip_line:
+            # end of a line which was too long
+            self._skip_line = False
+            return
+
+        if len(self._inqueue) >= conf.input_queue_max:
+            if not self._flooded:
+                self._flooded = True
+                self.simessage('Too much input. Some commands were ignored.')
+            return
+
+        self._inqueue.append(line)
+        self.run_queue()
+
+    def lineLengthExceeded(self, line):
+        'Drop a line longer than MAX_LENGTH, and keep the connection.'
+
+        self.simessage('Line too long. Ignored.')
+        if self.delimiter in line:
+            # LineReceiver stops here, so the rest is handled by
+            #   dataReceived before any more data is read
+            self._leftover = line.split(self.delimiter, 1)[1]
+        else:
+            self._skip_line = True
+
+    def run_queue(self):
+        '''Run as many commands from the input queue as the rate allows,
+            and arrange to be called again if any are left.
+
+        '''
+
+        if self._input_call is not None:
+            if self._input_call.active():
+                self._input_call.cancel()
+            self._input_call = None
+
+        now = time.time()
+        self._tokens = min(conf.input_burst, self._tokens +
+                            (now - self._tokens_time) * conf.input_rate)
+        self._tokens_time = now
+
+        while self._inqueue and self._tokens >= 1:
+            if self._waiting:
+                # _done_waiting will start the queue again
+                return
+            if self.logged_in and self.room is None:
+                # log in not complete yet. Try again a bit later.
+                self._input_call = reactor.callLater(0.6, self.run_queue)
+                return
+            if self.transport.disconnecting:
+                self._inqueue.clear()
+                return
+
+            self._tokens -= 1
+            self.command(self._inqueue.popleft())
+
+        if self._inqueue:
+            wait = (1 - self._tokens) / conf.input_rate
+            self._input_call = reactor.callLater(wait, self.run_queue)
+        else:
+            self._flooded = False
+
+    def command(self, line):
+        '''Run one line of input from the client.
+
         Except for "login" and "create", if the player is logged in,
             the line is sent to the parser, then dispatched to the
             proper command section if possible.
@@ -256,7 +641,7 @@ class TZ(basic.LineReceiver):
 
         try:
             if not self.logged_in and line=='quit':
-                self.transport.loseConnection()
+                self.disconnect()
             elif not self.logged_in and line.startswith('login '):
                 self.login(line[6:])
 
@@ -269,12 +654,6 @@ class TZ(basic.LineReceiver):
             elif not self.logged_in:
                 self.simessage('Must log in with "login <name> <password>"')
 
-            elif self.room is None:
-                # log in not complete yet. Try waiting a bit and sending
-                #   this command through again later.
-                reactor.callLater(0.6, self.lineReceived, line)
-                return
-
             else:
                 t = time.time()
                 self.player.active = t
@@ -308,7 +687,7 @@ class TZ(basic.LineReceiver):
                             line = "say " + line
 
                     try:
-                        result = parse.full_parser.parseString(line)
+                        result = parse.parse_line(line)
                     except parse.ParseException:
                         cmd = '##parseproblem'
                     else:
@@ -412,7 +791,7 @@ class TZ(basic.LineReceiver):
                 line = cmd + ' ' + restline
 
                 try:
-                    result = parse.full_parser.parseString(line)
+                    result = parse.parse_line(line)
                 except parse.ParseException:
                     cmd = '##parseproblem'
                 else:
@@ -481,7 +860,7 @@ class TZ(basic.LineReceiver):
             msg = msg.encode('utf-8')
         except UnicodeDecodeError:
             msg = '??UDE??'
-        self.transport.write(msg + '\r\n')
+        self.write(msg + '\r\n')
 
     def message(self, *args, **kw):
         'Send line to client, possibly indented and colorized.'
@@ -489,6 +868,15 @@ class TZ(basic.LineReceiver):
         indent = kw.get('indent', 0)
         color = kw.get('color', True)
 
+        self.write(self.render(self.format(*args), indent, color))
+
+    def format(self, *args):
+        '''Join args into one message.
+
+        A final argument of ".", "?" or "!" is attached without a space.
+
+        '''
+
         strs = []
         for arg in args:
             try:
@@ -507,37 +895,125 @@ class TZ(basic.LineReceiver):
         if punctuation:
             msg += punctuation
 
+        return msg
+
+    def render(self, msg, indent=0, color=True):
+        'Render msg using the settings for this client.'
+
+        return render(msg, color and self.colored(), indent, self.width())
+
+    def colored(self):
+        'Return True if this client should get ANSI colors.'
+
         cset = self.player.user_settings.get('ansi', conf.ansi_color_default)
-        if color and cset:
-            msg = msg % colors.yes
-            wrapped = ansiwrap(msg)
-        else:
-            msg = msg % colors.no
-            wrapped = wrap(msg)
+        return bool(cset)
 
-        if wrapped:
-            for line in wrapped:
-                line = line.encode('utf-8')
-                self.transport.write(' '*indent + line + '\r\n')
-        else:
-            self.transport.write('\r\n')
+    def width(self, default=None):
+        '''Return the line width set by the player, or the width of
+            the client window (if the client reported it), or default.
+
+        '''
+
+        width = self.player.user_settings.get('width', None) or None
+        if width is None and self.naws_width:
+            width = self.naws_width - 1
+            if not 20 <= width <= 250:
+                width = None
+        if width is None:
+            width = default
+        return width
+
+    def pagesize(self):
+        'Return the number of lines per page, or 0 for no paging.'
+
+        return self.player.user_settings.get('pager', 0) or 0
+
+    def render_key(self):
+        '''Return the client settings which affect how messages
+            are rendered for this client.
+
+        '''
+
+        return (self.colored(), self.width())
 
     def mlmessage(self, lines, indent=0, color=True):
-        'Send a multi-line message.'
+        '''Send a multi-line message.
+
+        lines may be any iterable (a generator, for instance) and is
+            only consumed as the lines are sent. If the player has set
+            a pager, sends one page and keeps the rest for "more".
+
+        '''
 
+        self.page(lines, indent, color)
+
+    def page(self, lines, indent=0, color=True):
+        '''Send lines, one page at a time if the player has set pager.
+
+        If the lines do not all fit in one page, the rest replace any
+            output already waiting for "more".
+
+        '''
+
+        pager = [iter(lines), indent, color]
+        if self._send_page(pager):
+            self._pager = pager
+
+    def more(self):
+        '''Send the next page of waiting output.
+
+        Return False if there was nothing waiting.
+
+        '''
+
+        pager = self._pager
+        if pager is None:
+            return False
+
+        self._pager = None
+        if self._send_page(pager):
+            self._pager = pager
+        return True
+
+    def _send_page(self, pager):
+        '''Send one page from pager.
+
+        Return True if there are lines left over, or False if the
+            lines ran out.
+
+        '''
+
+        lines, indent, color = pager
+        size = self.pagesize()
+        sent = 0
         for line in lines:
-            self.message(line, indent=indent, color=color)
+            data = self.render(self.format(line), indent, color)
+            self.write(data)
+            sent += data.count('\r\n')
+            if size and sent >= size:
+                break
+        else:
+            return False
+
+        # Check if that was the last line
+        try:
+            line = lines.next()
+        except StopIteration:
+            return False
+
+        from itertools import chain
+        pager[0] = chain([line], lines)
+        self.message('-- more -- (type "more" to continue)')
+        return True
 
     def simlmessage(self, lines):
         for line in lines:
             self.simessage(line)
 
     def broadcast(self, msg='', indent=0, color=True):
-        'Send a message to all connected clients.'
+        'Send a message to all logged in clients.'
 
-        for client in self.factory.clients:
-            if not client.logged_in:
-                continue
+        for client in self.factory._logged_in:
             client.message(msg, indent=indent, color=color)
 
     def columns(self, items, color=None):
@@ -551,14 +1027,14 @@ class TZ(basic.LineReceiver):
                 maxlen = l
 
         width = maxlen + 2
-        cols = (70 / width) - 1
+        cols = max(1, (self.width(79) - 9) / width - 1)
 
         filled_items = [item.ljust(width, ' ') for item in items]
         if color is not None:
             filled_items = [color(item) for item in filled_items]
         from itertools import izip, chain, repeat
-        for row in izip(*[chain(filled_items, repeat('', cols-1))]*cols):
-            self.message('  '.join(row), indent=4)
+        rows = izip(*[chain(filled_items, repeat('', cols-1))]*cols)
+        self.page(('  '.join(row) for row in rows), indent=4)
 
     def columns_v(self, items, color=None):
         '''Send list of strings out as a multi-column list.
@@ -578,7 +1054,7 @@ class TZ(basic.LineReceiver):
 
         li = len(items)
         width = maxlen + 2
-        cols = (70 / width) - 1
+        cols = max(1, (self.width(79) - 9) / width - 1)
         rows = li / cols
         if li % cols:
             rows += 1
@@ -613,19 +1089,18 @@ class TZ(basic.LineReceiver):
         if color is not None:
             filled_items = [color(item) for item in filled_items]
         from itertools import izip, chain, repeat
-        for row in izip(*[chain(filled_items, repeat('', cols-1))]*cols):
-            self.message('  '.join(row), indent=4)
+        rows = izip(*[chain(filled_items, repeat('', cols-1))]*cols)
+        self.page(('  '.join(row) for row in rows), indent=4)
 
     @classmethod
     def who(cls):
-        'Return list of names of players connected right now.'
+        'Return list of the players connected right now.'
 
-        names = cls.factory._player_protocols.keys()
-        return [players.getname(name) for name in names]
+        return [client.player for client in cls.factory._logged_in]
 
     @classmethod
     def clients(cls):
-        'Return list of all connected client protocols.'
+        'Return the set of all connected client protocols.'
 
         return cls.factory.clients
 
@@ -633,13 +1108,13 @@ class TZ(basic.LineReceiver):
     def roomclients(cls, room):
         'Return list of client protocols with players in the given room.'
 
-        return [client for client in cls.clients if client.room==room]
+        return list(cls.factory._room_clients.get(room.tzid, ()))
 
     @classmethod
     def playerclient(cls, player):
         'Return the protocol of the given player.'
 
-        return cls.factory._player_protocols.get(player.name, None)
+        return cls.factory._player_protocols.get(player.tzid, None)
 
     @classmethod
     def purge_all(cls):
@@ -655,5 +1130,5 @@ class TZ(basic.LineReceiver):
         if player.logged_in:
             client = cls.playerclient(player)
             if client is not None:
-                client.transport.loseConnection()
+                client.disconnect()
             player.logged_in = False
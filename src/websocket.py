@@ -0,0 +1,542 @@
+# Copyright 2008 Lee Harr
+#
+# This file is part of TZMud.
+#
+# TZMud is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# TZMud is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with TZMud.  If not, see <http://www.gnu.org/licenses/>.
+
+
+'''WebSocket (RFC 6455) front end, with permessage-deflate (RFC 7692).
+
+Each WebSocket connection wraps a normal TZ protocol, so browser
+    clients use exactly the same command and message code as telnet
+    clients. Everything the TZ protocol writes during one reactor turn
+    (it already buffers its output) goes out as a single text frame.
+    Each message from the client is treated as one line of input.
+
+Run this module to connect to a running server with a simple local
+    client:
+
+    python src/websocket.py [<host> [<port>]]
+
+'''
+
+import os
+import sys
+import base64
+import hashlib
+import struct
+import zlib
+
+from twisted.internet import protocol
+
+if __name__ == '__main__':
+    etc = os.path.abspath('etc')
+    sys.path.append(etc)
+
+import conf
+
+
+GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+CONT = 0x0
+TEXT = 0x1
+BINARY = 0x2
+CLOSE = 0x8
+PING = 0x9
+PONG = 0xA
+
+DEFLATE_TAIL = '\x00\x00\xff\xff'
+
+
+class ProtocolError(Exception):
+    'The other end did not follow the WebSocket protocol.'
+
+    code = 1002
+
+class MessageTooBig(ProtocolError):
+    'A message was larger than conf.websocket_max_message.'
+
+    code = 1009
+
+
+def accept_key(key):
+    'Return the Sec-WebSocket-Accept value for the given client key.'
+
+    return base64.b64encode(hashlib.sha1(key + GUID).digest())
+
+def parse_extensions(header):
+    '''Parse a Sec-WebSocket-Extensions header.
+
+    Returns a list of (name, params dict) in the order given.
+
+    '''
+
+    extensions = []
+    for ext in header.split(','):
+        parts = [p.strip() for p in ext.split(';')]
+        if not parts[0]:
+            continue
+        params = {}
+        for param in parts[1:]:
+            if '=' in param:
+                k, v = param.split('=', 1)
+                params[k.strip()] = v.strip().strip('"')
+            elif param:
+                params[param] = True
+        extensions.append((parts[0], params))
+    return extensions
+
+
+class FrameCodec(object):
+    '''Encodes and decodes WebSocket frames for one end of a connection.
+
+    mask should be True for a client (which must mask its frames) and
+        False for a server.
+
+    If deflate is True, messages are compressed with permessage-deflate.
+        Compression context is kept between messages unless this end
+        was asked not to (no_context_takeover), and likewise for the
+        other end (peer_no_context_takeover).
+
+    '''
+
+    def __init__(self, mask, deflate=False, no_context_takeover=False,
+                    peer_no_context_takeover=False):
+        self.mask = mask
+        self.deflate = deflate
+        self.no_context_takeover = no_context_takeover
+        self.peer_no_context_takeover = peer_no_context_takeover
+
+        self._buf = ''
+        self._fragments = []
+        self._size = 0
+        self._opcode = None
+        self._compressed = False
+
+        self._compressor = None
+        self._decompressor = None
+
+    def compress(self, data):
+        if self._compressor is None or self.no_context_takeover:
+            self._compressor = zlib.compressobj(conf.websocket_deflate_level,
+                                                zlib.DEFLATED, -15)
+        data = self._compressor.compress(data)
+        data += self._compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data.endswith(DEFLATE_TAIL):
+            data = data[:-4]
+        return data
+
+    def decompress(self, data):
+        if self._decompressor is None or self.peer_no_context_takeover:
+            self._decompressor = zlib.decompressobj(-15)
+        limit = conf.websocket_max_message
+        data = self._decompressor.decompress(data + DEFLATE_TAIL, limit + 1)
+        if self._decompressor.unconsumed_tail or len(data) > limit:
+            raise MessageTooBig('message too large')
+        return data
+
+    def encode(self, payload, opcode=TEXT):
+        'Return payload as one complete frame.'
+
+        rsv1 = 0
+        if self.deflate and opcode in (TEXT, BINARY):
+            payload = self.compress(payload)
+            rsv1 = 0x40
+
+        header = chr(0x80 | rsv1 | opcode)
+
+        n = len(payload)
+        if self.mask:
+            maskbit = 0x80
+        else:
+            maskbit = 0
+        if n < 126:
+            header += chr(maskbit | n)
+        elif n < 65536:
+            header += chr(maskbit | 126) + struct.pack('!H', n)
+        else:
+            header += chr(maskbit | 127) + struct.pack('!Q', n)
+
+        if self.mask:
+            key = os.urandom(4)
+            header += key
+            payload = apply_mask(key, payload)
+
+        return header + payload
+
+    def decode(self, data):
+        '''Add data received to the buffer, and return a list of the
+            complete messages, as (opcode, payload) pairs.
+
+        '''
+
+        self._buf += data
+        messages = []
+        while True:
+            frame = self._next_frame()
+            if frame is None:
+                break
+            fin, rsv1, opcode, payload = frame
+
+            if opcode >= CLOSE:
+                # control frames may come between fragments
+                messages.append((opcode, payload))
+                continue
+
+            if opcode == CONT:
+                if self._opcode is None:
+                    raise ProtocolError('unexpected continuation frame')
+            else:
+                if self._opcode is not None:
+                    raise ProtocolError('expected continuation frame')
+                self._opcode = opcode
+                self._compressed = rsv1
+
+            self._size += len(payload)
+            if self._size > conf.websocket_max_message:
+                raise MessageTooBig('message too large')
+            self._fragments.append(payload)
+            if fin:
+                payload = ''.join(self._fragments)
+                if self._compressed:
+                    payload = self.decompress(payload)
+                messages.append((self._opcode, payload))
+                self._fragments = []
+                self._size = 0
+                self._opcode = None
+                self._compressed = False
+
+        return messages
+
+    def _next_frame(self):
+        buf = self._buf
+        if len(buf) < 2:
+            return None
+
+        b0, b1 = ord(buf[0]), ord(buf[1])
+        fin = b0 & 0x80
+        rsv1 = b0 & 0x40
+        opcode = b0 & 0x0F
+        masked = b1 & 0x80
+        n = b1 & 0x7F
+
+        if rsv1 and not self.deflate:
+            raise ProtocolError('compressed frame without deflate')
+        if bool(masked) == bool(self.mask):
+            # each end must mask only what the other end does not
+            raise ProtocolError('bad masking')
+
+        pos = 2
+        if n == 126:
+            if len(buf) < 4:
+                return None
+            n = struct.unpack('!H', buf[2:4])[0]
+            pos = 4
+        elif n == 127:
+            if len(buf) < 10:
+                return None
+            n = struct.unpack('!Q', buf[2:10])[0]
+            pos = 10
+
+        if n > conf.websocket_max_message:
+            raise MessageTooBig('frame too large')
+
+        if masked:
+            if len(buf) < pos + 4:
+                return None
+            key = buf[pos:pos+4]
+            pos += 4
+
+        if len(buf) < pos + n:
+            return None
+
+        payload = buf[pos:pos+n]
+        if masked:
+            payload = apply_mask(key, payload)
+        self._buf = buf[pos+n:]
+
+        return fin, rsv1, opcode, payload
+
+
+def apply_mask(key, data):
+    'Mask (or unmask) data with the 4 byte key.'
+
+    key = [ord(c) for c in key]
+    return ''.join([chr(ord(c) ^ key[i % 4]) for i, c in enumerate(data)])
+
+
+class WebSocketTransport(object):
+    '''Transport given to the wrapped TZ protocol.
+
+    Each write becomes one text frame. Everything else is passed on to
+        the real transport.
+
+    '''
+
+    def __init__(self, ws):
+        self.ws = ws
+        self.transport = ws.transport
+
+    def _get_disconnecting(self):
+        return self.ws.closing or self.transport.disconnecting
+    disconnecting = property(_get_disconnecting)
+
+    def write(self, data):
+        self.ws.send_frame(data, TEXT)
+
+    def writeSequence(self, seq):
+        self.write(''.join(seq))
+
+    def loseConnection(self):
+        self.ws.close()
+
+    def registerProducer(self, producer, streaming):
+        self.transport.registerProducer(producer, streaming)
+
+    def unregisterProducer(self):
+        self.transport.unregisterProducer()
+
+    def pauseProducing(self):
+        self.transport.pauseProducing()
+
+    def resumeProducing(self):
+        self.transport.resumeProducing()
+
+    def getPeer(self):
+        return self.transport.getPeer()
+
+    def getHost(self):
+        return self.transport.getHost()
+
+
+class WebSocketServer(protocol.Protocol):
+    '''Server side of one WebSocket connection.
+
+    Does the HTTP upgrade handshake, then hands each message from the
+        client to a TZ protocol built by factory.tzfactory.
+
+    '''
+
+    def connectionMade(self):
+        self._handshake = ''
+        self.codec = None
+        self.inner = None
+        self.closing = False
+
+    def dataReceived(self, data):
+        try:
+            if self.codec is None:
+                self._handshake += data
+                if '\r\n\r\n' not in self._handshake:
+                    if len(self._handshake) > 8192:
+                        self.transport.loseConnection()
+                    return
+                request, data = self._handshake.split('\r\n\r\n', 1)
+                self._handshake = ''
+                if not self.handshake(request):
+                    return
+
+            for opcode, payload in self.codec.decode(data):
+                self.message_received(opcode, payload)
+
+        except ProtocolError, e:
+            print 'WebSocket error:', e
+            self.close(e.code)
+
+    def handshake(self, request):
+        'Check the upgrade request, and answer it. Return True if ok.'
+
+        lines = request.split('\r\n')
+        headers = {}
+        for line in lines[1:]:
+            if ':' in line:
+                k, v = line.split(':', 1)
+                k = k.strip().lower()
+                if k in headers:
+                    headers[k] += ', ' + v.strip()
+                else:
+                    headers[k] = v.strip()
+
+        key = headers.get('sec-websocket-key')
+        if (not lines[0].startswith('GET ') or
+                headers.get('upgrade', '').lower() != 'websocket' or
+                key is None):
+            self.transport.write('HTTP/1.1 400 Bad Request\r\n\r\n')
+            self.transport.loseConnection()
+            return False
+
+        response = ['HTTP/1.1 101 Switching Protocols',
+                    'Upgrade: websocket',
+                    'Connection: Upgrade',
+                    'Sec-WebSocket-Accept: %s' % accept_key(key)]
+
+        deflate = False
+        no_context_takeover = False
+        peer_no_context_takeover = False
+        if conf.websocket_deflate:
+            offers = parse_extensions(headers.get('sec-websocket-extensions', ''))
+            for name, params in offers:
+                if name == 'permessage-deflate':
+                    deflate = True
+                    ext = 'permessage-deflate'
+                    if 'server_no_context_takeover' in params:
+                        no_context_takeover = True
+                        ext += '; server_no_context_takeover'
+                    if 'client_no_context_takeover' in params:
+                        peer_no_context_takeover = True
+                        ext += '; client_no_context_takeover'
+                    response.append('Sec-WebSocket-Extensions: %s' % ext)
+                    break
+
+        self.transport.write('\r\n'.join(response) + '\r\n\r\n')
+
+        self.codec = FrameCodec(False, deflate, no_context_takeover,
+                                    peer_no_context_takeover)
+
+        self.inner = self.factory.tzfactory.buildProtocol(
+                                                self.transport.getPeer())
+        self.inner.telnet = False
+        self.inner.makeConnection(WebSocketTransport(self))
+        return True
+
+    def message_received(self, opcode, payload):
+        if opcode in (TEXT, BINARY):
+            if not payload.endswith('\n'):
+                payload += '\n'
+            self.inner.dataReceived(payload)
+        elif opcode == PING:
+            self.send_frame(payload, PONG)
+        elif opcode == CLOSE:
+            if not self.closing:
+                self.closing = True
+                self.send_frame(payload[:2], CLOSE)
+            self.transport.loseConnection()
+
+    def send_frame(self, payload, opcode=TEXT):
+        if self.closing and opcode != CLOSE:
+            return
+        self.transport.write(self.codec.encode(payload, opcode))
+
+    def close(self, code=1000):
+        'Start the closing handshake.'
+
+        if self.codec is not None and not self.closing:
+            self.send_frame(struct.pack('!H', code), CLOSE)
+        self.closing = True
+        self.transport.loseConnection()
+
+    def connectionLost(self, reason):
+        if self.inner is not None:
+            self.inner.connectionLost(reason)
+
+
+class WebSocketFactory(protocol.ServerFactory):
+    'Builds WebSocketServer protocols, each wrapping a TZ from tzfactory.'
+
+    protocol = WebSocketServer
+
+    def __init__(self, tzfactory):
+        self.tzfactory = tzfactory
+
+
+class WebSocketClient(protocol.Protocol):
+    '''Simple client, for testing.
+
+    Offers permessage-deflate, prints everything the server sends,
+        and sends each line typed as a message.
+
+    '''
+
+    def connectionMade(self):
+        self.key = base64.b64encode(os.urandom(16))
+        self.codec = None
+        self._handshake = ''
+        host = self.transport.getPeer()
+        request = ['GET / HTTP/1.1',
+                    'Host: %s:%s' % (host.host, host.port),
+                    'Upgrade: websocket',
+                    'Connection: Upgrade',
+                    'Sec-WebSocket-Key: %s' % self.key,
+                    'Sec-WebSocket-Version: 13',
+                    'Sec-WebSocket-Extensions: permessage-deflate']
+        self.transport.write('\r\n'.join(request) + '\r\n\r\n')
+
+    def dataReceived(self, data):
+        if self.codec is None:
+            self._handshake += data
+            if '\r\n\r\n' not in self._handshake:
+                return
+            response, data = self._handshake.split('\r\n\r\n', 1)
+            if accept_key(self.key) not in response:
+                print 'Handshake failed:'
+                print response
+                self.transport.loseConnection()
+                return
+            deflate = 'permessage-deflate' in response
+            self.codec = FrameCodec(True, deflate)
+            print '(connected, deflate=%s)' % deflate
+            self.opened()
+
+        for opcode, payload in self.codec.decode(data):
+            if opcode == TEXT:
+                self.received(payload)
+            elif opcode == CLOSE:
+                self.transport.loseConnection()
+
+    def opened(self):
+        'Called once the handshake is complete.'
+
+        pass
+
+    def received(self, payload):
+        'Called with each text message from the server.'
+
+        sys.stdout.write(payload)
+        sys.stdout.flush()
+
+    def send(self, line):
+        self.transport.write(self.codec.encode(line.encode('utf-8')))
+
+    def connectionLost(self, reason):
+        print '(disconnected)'
+
+
+if __name__ == '__main__':
+    from twisted.internet import reactor, stdio
+    from twisted.protocols import basic
+
+    host = '127.0.0.1'
+    port = conf.websocket_port
+    if len(sys.argv) > 1:
+        host = sys.argv[1]
+    if len(sys.argv) > 2:
+        port = int(sys.argv[2])
+
+    class Input(basic.LineReceiver):
+        delimiter = '\n'
+        def lineReceived(self, line):
+            client.send(line.decode('utf-8'))
+
+    class Client(WebSocketClient):
+        def opened(self):
+            stdio.StandardIO(Input())
+        def connectionLost(self, reason):
+            WebSocketClient.connectionLost(self, reason)
+            reactor.stop()
+
+    client = Client()
+    factory = protocol.ClientFactory()
+    factory.buildProtocol = lambda addr: client
+    reactor.connectTCP(host, port, factory)
+    reactor.run()
@@ -405,10 +405,8 @@ def cmd_list(s, r):
     if objs:
         s.message('Existing objects:')
         objs.sort(key=operator.attrgetter('tzid'))
-        msgs = []
-        for obj in objs:
-            tzid = '(%s)' % obj.tzid
-            msgs.append('%s %s' % (tzid.rjust(4, ' '), obj))
+        msgs = ('%s %s' % (('(%s)' % obj.tzid).rjust(4, ' '), obj)
+                    for obj in objs)
         s.mlmessage(msgs, indent=4)
     else:
         s.message('No', listing, 'yet.')
@@ -0,0 +1,85 @@
+# Copyright 2008 Lee Harr
+#
+# This file is part of TZMud.
+#
+# TZMud is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# TZMud is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with TZMud.  If not, see <http://www.gnu.org/licenses/>.
+
+
+'''Tests for the database name indexes.
+
+Run from the top level directory:
+
+    python -m unittest discover tests
+
+'''
+
+import os
+import sys
+import unittest
+
+top = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(top, 'etc'))
+sys.path.append(os.path.join(top, 'src'))
+
+import conf
+conf.load_plugins = False
+
+import db
+
+
+class Obj(object):
+    def __init__(self, tzid, name, name_aka=()):
+        self.tzid = tzid
+        self.name = name
+        self.name_aka = list(name_aka)
+
+
+def name_index(dbroot, section):
+    # skip __init__, which opens the real database
+    index = db.TZNameIndex.__new__(db.TZNameIndex)
+    index.section = section
+    index.akas = True
+    index.dbroot = dbroot
+    return index
+
+
+class NameIndexTest(unittest.TestCase):
+    def old_root(self):
+        'A database root from before the name indexes existed.'
+
+        rooms = db.TZIOBTree()
+        rooms[1] = Obj(1, u'void')
+        rooms[2] = Obj(2, u'house', [u'home'])
+        return {'rooms': rooms}
+
+    def test_first_lookup(self):
+        dbroot = self.old_root()
+        index = name_index(dbroot, 'rooms')
+
+        # the first lookup builds the index, and must use it
+        self.assertEqual(index.find(u'house'), [2])
+        self.assertTrue('_names' in dbroot)
+        self.assertEqual(index.find(u'void'), [1])
+
+    def test_first_lookup_aka(self):
+        index = name_index(self.old_root(), 'rooms')
+        self.assertEqual(index.find(u'the home'), [2])
+
+    def test_missing(self):
+        index = name_index(self.old_root(), 'rooms')
+        self.assertEqual(index.find(u'attic'), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+# Copyright 2008 Lee Harr
+#
+# This file is part of TZMud.
+#
+# TZMud is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# TZMud is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with TZMud.  If not, see <http://www.gnu.org/licenses/>.
+
+
+'''Tests for actions which spread to nearby rooms.
+
+Run from the top level directory:
+
+    python -m unittest discover tests
+
+'''
+
+import os
+import sys
+import unittest
+
+top = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(top, 'etc'))
+sys.path.append(os.path.join(top, 'src'))
+
+import conf
+conf.load_plugins = False
+
+import rooms
+
+
+class Exit(object):
+    def __init__(self, destination):
+        self.destination = destination
+        self._destid = destination.tzid
+
+
+class PlainRoom(rooms.Room):
+    'Room which records what it hears instead of passing it on.'
+
+    def exits(self):
+        return self._test_exits
+
+    def act_near(self, info):
+        self.heard.append(info)
+
+
+class QuietRoom(PlainRoom):
+    'Room which overrides action, like the Library plugin.'
+
+    def action(self, info):
+        self.filtered.append(info)
+
+
+def room(cls, tzid):
+    r = cls.__new__(cls)
+    r.__dict__.update(tzid=tzid, heard=[], filtered=[], _test_exits=[])
+    return r
+
+def link(room, dest):
+    room._test_exits.append(Exit(dest))
+
+
+class PropagateTest(unittest.TestCase):
+    def setUp(self):
+        self.route = rooms.exits.route
+        rooms.exits.route = lambda room, dest: None
+
+    def tearDown(self):
+        rooms.exits.route = self.route
+
+    def test_overridden_action(self):
+        # a -> b (quiet) -> c, and a -> d -> e
+        a = room(PlainRoom, 1)
+        b = room(QuietRoom, 2)
+        c = room(PlainRoom, 3)
+        d = room(PlainRoom, 4)
+        e = room(PlainRoom, 5)
+        link(a, b)
+        link(b, c)
+        link(a, d)
+        link(d, e)
+
+        a.propagate(dict(act='shout', actor=None, spread=2))
+
+        # b gets the action through its own action method
+        self.assertEqual(len(b.filtered), 1)
+        self.assertEqual(b.heard, [])
+        self.assertTrue(b.filtered[0]['fromroom'] is a)
+        self.assertEqual(b.filtered[0]['spread'], 1)
+
+        # b spreads it on itself (if it wants to), not propagate
+        self.assertEqual(c.heard, [])
+
+        self.assertEqual(len(d.heard), 1)
+        self.assertEqual(len(e.heard), 1)
+        self.assertTrue(e.heard[0]['fromroom'] is d)
+
+        self.assertEqual(b.filtered[0]['visited'], set([1, 2, 4, 5]))
+
+    def test_heard_once(self):
+        # a -> b -> c and a -> c
+        a = room(PlainRoom, 1)
+        b = room(PlainRoom, 2)
+        c = room(PlainRoom, 3)
+        link(a, b)
+        link(b, c)
+        link(a, c)
+
+        a.propagate(dict(act='shout', actor=None, spread=2))
+
+        self.assertEqual(len(b.heard), 1)
+        self.assertEqual(len(c.heard), 1)
+        self.assertTrue(c.heard[0]['fromroom'] is a)
+
+
+if __name__ == '__main__':
+    unittest.main()
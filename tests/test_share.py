@@ -0,0 +1,89 @@
+# Copyright 2008 Lee Harr
+#
+# This file is part of TZMud.
+#
+# TZMud is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# TZMud is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with TZMud.  If not, see <http://www.gnu.org/licenses/>.
+
+
+'''Tests for the compact settings kept in _vals.
+
+Run from the top level directory:
+
+    python -m unittest discover tests
+
+'''
+
+import os
+import sys
+import unittest
+
+top = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(top, 'etc'))
+sys.path.append(os.path.join(top, 'src'))
+
+import conf
+conf.load_plugins = False
+
+import share
+import rooms
+
+
+def old_room(**state):
+    'Return a Room with the given instance state, as if loaded from the db.'
+
+    room = rooms.Room.__new__(rooms.Room)
+    room.__dict__.update(state)
+    return room
+
+
+class CompactSettingsTest(unittest.TestCase):
+    def test_legacy_attributes(self):
+        room = old_room(_name=u'void', _short=u'A very dark darkness',
+                        _period=rooms.Room._setting_defaults['period'],
+                        settings=['name', 'short', 'period'])
+        share.compact_settings(room)
+
+        self.assertEqual(room._vals,
+                            {'name': u'void', 'short': u'A very dark darkness'})
+        self.assertFalse('_name' in room.__dict__)
+        self.assertFalse('settings' in room.__dict__)
+        self.assertEqual(room.name, u'void')
+
+    def test_keeps_existing_vals(self):
+        room = old_room(_vals={'name': u'void', 'short': u'A very dark darkness'},
+                        _long=u'Nothing to see.',
+                        settings=['name', 'short', 'long'])
+        share.compact_settings(room)
+
+        self.assertEqual(room.name, u'void')
+        self.assertEqual(room.short, u'A very dark darkness')
+        self.assertEqual(room.long, u'Nothing to see.')
+        self.assertFalse('_long' in room.__dict__)
+
+    def test_vals_win_over_legacy(self):
+        room = old_room(_vals={'name': u'house'}, _name=u'proto room')
+        share.compact_settings(room)
+
+        self.assertEqual(room.name, u'house')
+
+    def test_list_settings(self):
+        room = old_room(_vals={'name': u'void'}, _name_aka=[u'dark'])
+        share.compact_settings(room)
+
+        self.assertEqual(room._vals['name_aka'], (u'dark',))
+        self.assertEqual(room.name_aka, [u'dark'])
+
+
+if __name__ == '__main__':
+    unittest.main()
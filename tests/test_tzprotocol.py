@@ -0,0 +1,97 @@
+# Copyright 2008 Lee Harr
+#
+# This file is part of TZMud.
+#
+# TZMud is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# TZMud is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with TZMud.  If not, see <http://www.gnu.org/licenses/>.
+
+
+'''Tests for the client registries kept by the TZ protocol.
+
+Run from the top level directory:
+
+    python -m unittest discover tests
+
+'''
+
+import os
+import sys
+import unittest
+
+top = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(top, 'etc'))
+sys.path.append(os.path.join(top, 'src'))
+
+from tzprotocol import TZ
+
+
+class Room(object):
+    def __init__(self, tzid):
+        self.tzid = tzid
+
+
+class Factory(object):
+    def __init__(self):
+        self._room_clients = {}
+
+
+class RoomRegistryTest(unittest.TestCase):
+    def setUp(self):
+        self.old_factory = TZ.__dict__.get('factory')
+        TZ.factory = Factory()
+
+    def tearDown(self):
+        if self.old_factory is None:
+            del TZ.factory
+        else:
+            TZ.factory = self.old_factory
+
+    def client(self):
+        # skip TZ.__init__, which opens the database
+        s = TZ.__new__(TZ)
+        s._room = None
+        return s
+
+    def test_new_style(self):
+        self.assertTrue(isinstance(TZ, type))
+
+    def test_assign_room(self):
+        r1, r2 = Room(1), Room(2)
+        s = self.client()
+
+        s.room = r1
+        self.assertFalse('room' in s.__dict__)
+        self.assertTrue(s.room is r1)
+        self.assertEqual(TZ.roomclients(r1), [s])
+
+        s.room = r2
+        self.assertEqual(TZ.roomclients(r1), [])
+        self.assertEqual(TZ.roomclients(r2), [s])
+
+        s.room = None
+        self.assertEqual(TZ.roomclients(r2), [])
+        self.assertEqual(TZ.factory._room_clients, {})
+
+    def test_two_clients(self):
+        r1 = Room(1)
+        s1, s2 = self.client(), self.client()
+        s1.room = r1
+        s2.room = r1
+        self.assertEqual(set(TZ.roomclients(r1)), set([s1, s2]))
+
+        s1.room = None
+        self.assertEqual(TZ.roomclients(r1), [s2])
+
+
+if __name__ == '__main__':
+    unittest.main()